@@ -1,29 +1,101 @@
 """Discrepancy Detection Agent - Flags price/quantity mismatches with confidence scores."""
 
+import io
 import time
-from typing import List, Optional
-from rapidfuzz import fuzz
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from rapidfuzz import fuzz, process
 
-from src.core.state import AgentState
-from src.core.config import ReconciliationRules
+from src.core.state import AgentState, record_trace
+from src.core.config import RULES
 from src.models.schemas import Discrepancy, ExtractedInvoice, MatchingResult
 
 
-def find_matching_po_item(invoice_item_desc: str, po_items: List[dict], threshold: float = 70) -> Optional[dict]:
-    """Find the best matching PO line item for an invoice line item."""
-    best_match = None
-    best_score = 0
+# Upper bounds of the price variance classes (right-inclusive):
+# within tolerance (<=2%), medium (<=5%), high (<=15%), escalate (>15%)
+PRICE_VARIANCE_BINS = np.array([
+    RULES.PRICE_VARIANCE_AUTO_APPROVE,
+    0.05,
+    RULES.PRICE_VARIANCE_ESCALATE
+])
+PRICE_CLASS_ESCALATE = 3
+PRICE_SEVERITY_BY_CLASS = ("low", "medium", "high", "high")
+PRICE_ACTION_BY_CLASS = ("auto_approve", "flag_for_review", "flag_for_review", "escalate_to_human")
+
+
+@lru_cache(maxsize=4096)
+def normalize_description(description: str) -> str:
+    """Lowercase and sort tokens so fuzz.ratio matches fuzz.token_sort_ratio semantics."""
+    return " ".join(sorted(description.lower().split()))
+
+
+@lru_cache(maxsize=8192)
+def _match_normalized_descriptions(
+    invoice_descs: Tuple[str, ...],
+    po_descs: Tuple[str, ...],
+    threshold: float
+) -> Tuple[Optional[int], ...]:
+    """Memoized best-match indices for already normalized descriptions."""
+    # Repeated descriptions (same product on several lines) share one score row
+    unique_descs = list(dict.fromkeys(invoice_descs))
     
-    for po_item in po_items:
-        score = fuzz.token_sort_ratio(
-            invoice_item_desc.lower(),
-            po_item.get("description", "").lower()
-        )
-        if score > best_score and score >= threshold:
-            best_score = score
-            best_match = po_item
+    scores = process.cdist(
+        unique_descs,
+        po_descs,
+        scorer=fuzz.ratio,
+        processor=None,
+        score_cutoff=threshold
+    )
+    
+    best_indices = scores.argmax(axis=1)
+    best_by_desc = {
+        desc: int(best_j) if scores[row, best_j] >= threshold else None
+        for row, (desc, best_j) in enumerate(zip(unique_descs, best_indices))
+    }
+    
+    return tuple(best_by_desc[desc] for desc in invoice_descs)
+
+
+def find_matching_po_items(invoice_descs: List[str], po_items: List[dict], threshold: float = 70) -> List[Optional[int]]:
+    """
+    Find the best matching PO line item for each invoice line item.
+    Scores the full invoice x PO description matrix in a single cdist call,
+    memoized so reprocessed invoices against the same PO skip scoring.
+    Returns: index into po_items per invoice description, or None if below threshold
+    """
+    if not invoice_descs or not po_items:
+        return [None] * len(invoice_descs)
+    
+    # Descriptions are pre-sorted once (and cached across invoices),
+    # so the plain ratio scorer avoids re-tokenizing every pair
+    return list(_match_normalized_descriptions(
+        tuple(normalize_description(desc) for desc in invoice_descs),
+        tuple(normalize_description(po_item.get("description", "")) for po_item in po_items),
+        threshold
+    ))
+
+
+def classify_line_variances(
+    matched_mask: np.ndarray,
+    invoice_prices: np.ndarray,
+    po_prices: np.ndarray,
+    invoice_qtys: np.ndarray,
+    po_qtys: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Variance kernel over aligned invoice/PO line arrays.
+    Returns: (price_variances, price_classes, price_flagged, qty_variances, qty_flagged)
+    """
+    price_variances = (invoice_prices - po_prices) / np.where(po_prices > 0, po_prices, 1.0)
+    qty_variances = (invoice_qtys - po_qtys) / np.where(po_qtys > 0, po_qtys, 1.0)
+    
+    # Price variance class per line: 0 within tolerance, 1 medium, 2 high, 3 escalate
+    price_classes = np.digitize(np.abs(price_variances), PRICE_VARIANCE_BINS, right=True)
+    price_flagged = matched_mask & (po_prices > 0) & (price_classes > 0)
+    qty_flagged = matched_mask & (po_qtys > 0) & (invoice_qtys != po_qtys)
     
-    return best_match
+    return price_variances, price_classes, price_flagged, qty_variances, qty_flagged
 
 
 def discrepancy_detection_agent(state: AgentState) -> AgentState:
@@ -31,201 +103,206 @@ def discrepancy_detection_agent(state: AgentState) -> AgentState:
     Discrepancy Detection Agent node for LangGraph.
     Identifies price, quantity, and total variances between invoice and PO.
     """
-    start_time = time.time()
+    start_ns = time.perf_counter_ns()
     
     extracted_data: Optional[ExtractedInvoice] = state.get("extracted_data")
     matching_results: Optional[MatchingResult] = state.get("matching_results")
     matched_po_data: Optional[dict] = state.get("matched_po_data")
     
     discrepancies: List[Discrepancy] = []
-    reasoning_parts = []
-    
-    # Check if we have data to compare
-    if extracted_data is None:
-        reasoning = "No extracted invoice data available for discrepancy detection."
-        state["discrepancies"] = discrepancies
-        state["discrepancy_reasoning"] = reasoning
-        duration_ms = int((time.time() - start_time) * 1000)
-        state["agent_traces"] = state.get("agent_traces", {})
-        state["agent_traces"]["discrepancy_detection_agent"] = {
-            "duration_ms": duration_ms,
-            "confidence": 0.0,
-            "status": "failed",
-            "reasoning": reasoning
-        }
-        return state
-    
-    # Check for missing PO reference
-    if not extracted_data.po_reference:
-        severity = "medium"
-        if matching_results and matching_results.matched_po:
-            details = (
-                f"Invoice does not contain a PO reference. "
-                f"Fuzzy matching by supplier and products suggests {matching_results.matched_po} "
-                f"({matching_results.po_match_confidence:.0%} confidence)."
-            )
-        else:
-            severity = "high"
-            details = "Invoice does not contain a PO reference and could not be matched to any PO."
-        
-        discrepancies.append(Discrepancy(
-            type="missing_po_reference",
-            severity=severity,
-            field="po_reference",
-            details=details,
-            recommended_action="flag_for_review" if matching_results and matching_results.matched_po else "escalate_to_human",
-            confidence=0.95
-        ))
-        reasoning_parts.append(f"Missing PO reference detected (severity: {severity}).")
-    
-    # If no matched PO, we can't do detailed comparison
-    if matched_po_data is None:
-        reasoning = " ".join(reasoning_parts) if reasoning_parts else "No matched PO for detailed comparison."
-        state["discrepancies"] = discrepancies
-        state["discrepancy_reasoning"] = reasoning
-        duration_ms = int((time.time() - start_time) * 1000)
-        state["agent_traces"] = state.get("agent_traces", {})
-        state["agent_traces"]["discrepancy_detection_agent"] = {
-            "duration_ms": duration_ms,
-            "confidence": 0.80,
-            "status": "partial",
-            "reasoning": reasoning
-        }
-        state["current_agent"] = "resolution"
-        return state
+    # Reasoning fragments are written space-terminated and trimmed once at the end
+    reasoning_buf = io.StringIO()
+    reasoning = ""
+    trace_confidence, trace_status = 0.0, "failed"
     
-    po_items = matched_po_data.get("line_items", [])
-    po_total = matched_po_data.get("total", 0)
-    
-    # Compare each invoice line item to PO
-    for idx, invoice_item in enumerate(extracted_data.line_items):
-        matched_po_item = find_matching_po_item(invoice_item.description, po_items)
+    # Every exit path records discrepancies, reasoning and the trace in the finally block
+    try:
+        # Check if we have data to compare
+        if extracted_data is None:
+            reasoning = "No extracted invoice data available for discrepancy detection."
+            return state
         
-        if matched_po_item is None:
-            # Extra item on invoice not in PO
-            discrepancies.append(Discrepancy(
-                type="extra_item",
-                severity="medium",
-                line_item_index=idx,
-                field="description",
-                details=f"Line item '{invoice_item.description}' not found in matched PO.",
-                recommended_action="flag_for_review",
-                confidence=0.85
+        # Check for missing PO reference
+        if not extracted_data.po_reference:
+            severity = "medium"
+            if matching_results and matching_results.matched_po:
+                details = (
+                    f"Invoice does not contain a PO reference. "
+                    f"Fuzzy matching by supplier and products suggests {matching_results.matched_po} "
+                    f"({matching_results.po_match_confidence:.0%} confidence)."
+                )
+            else:
+                severity = "high"
+                details = "Invoice does not contain a PO reference and could not be matched to any PO."
+            
+            discrepancies.append(Discrepancy.model_construct(
+                type="missing_po_reference",
+                severity=severity,
+                field="po_reference",
+                details=details,
+                recommended_action="flag_for_review" if matching_results and matching_results.matched_po else "escalate_to_human",
+                confidence=0.95
             ))
-            reasoning_parts.append(f"Extra item detected: '{invoice_item.description}'.")
-            continue
+            reasoning_buf.write(f"Missing PO reference detected (severity: {severity}). ")
+        
+        # If no matched PO, we can't do detailed comparison
+        if matched_po_data is None:
+            reasoning = reasoning_buf.getvalue().rstrip() or "No matched PO for detailed comparison."
+            trace_confidence, trace_status = 0.80, "partial"
+            state["current_agent"] = "resolution"
+            return state
         
-        # Check price variance
-        invoice_price = invoice_item.unit_price
-        po_price = matched_po_item.get("unit_price", 0)
+        po_items = matched_po_data.get("line_items", [])
+        po_total = matched_po_data.get("total", 0)
         
-        if po_price > 0:
-            price_variance = (invoice_price - po_price) / po_price
-            price_variance_pct = abs(price_variance * 100)
+        line_items = extracted_data.line_items
+        
+        # Match all invoice line items to PO line items in one pass
+        matched_indices = find_matching_po_items(
+            [item.description for item in line_items],
+            po_items
+        )
+        
+        # PO numerics as flat arrays with a trailing zero slot for unmatched lines (index -1)
+        po_unit_prices = np.append(
+            np.fromiter((po_item.get("unit_price", 0) for po_item in po_items), dtype=float, count=len(po_items)),
+            0.0
+        )
+        po_quantities = np.append(
+            np.fromiter((po_item.get("quantity", 0) for po_item in po_items), dtype=float, count=len(po_items)),
+            0.0
+        )
+        
+        # Compute price/quantity variances for all line items at once
+        matched_po_idx = np.fromiter(
+            (j if j is not None else -1 for j in matched_indices), dtype=np.intp, count=len(matched_indices)
+        )
+        matched_mask = matched_po_idx >= 0
+        invoice_prices = np.fromiter((item.unit_price for item in line_items), dtype=float, count=len(line_items))
+        po_prices = po_unit_prices[matched_po_idx]
+        invoice_qtys = np.fromiter((item.quantity for item in line_items), dtype=float, count=len(line_items))
+        po_qtys = po_quantities[matched_po_idx]
+        
+        (
+            price_variances, price_classes, price_flagged,
+            qty_variances, qty_flagged
+        ) = classify_line_variances(matched_mask, invoice_prices, po_prices, invoice_qtys, po_qtys)
+        
+        # Only unmatched or flagged line items need a Discrepancy built
+        for idx in np.flatnonzero(~matched_mask | price_flagged | qty_flagged).tolist():
+            invoice_item = line_items[idx]
+            item_label = f"Line item '{invoice_item.description}'"
+            
+            if not matched_mask[idx]:
+                # Extra item on invoice not in PO
+                discrepancies.append(Discrepancy.model_construct(
+                    type="extra_item",
+                    severity="medium",
+                    line_item_index=idx,
+                    field="description",
+                    details=f"{item_label} not found in matched PO.",
+                    recommended_action="flag_for_review",
+                    confidence=0.85
+                ))
+                reasoning_buf.write(f"Extra item detected: '{invoice_item.description}'. ")
+                continue
             
-            if abs(price_variance) > ReconciliationRules.PRICE_VARIANCE_ESCALATE:
-                # Major price discrepancy (>15%)
-                discrepancies.append(Discrepancy(
+            # Check price variance
+            if price_flagged[idx]:
+                invoice_price = invoice_item.unit_price
+                po_price = float(po_prices[idx])
+                price_variance = float(price_variances[idx])
+                price_variance_pct = abs(price_variance * 100)
+                price_class = price_classes[idx]
+                
+                discrepancies.append(Discrepancy.model_construct(
                     type="price_mismatch",
-                    severity="high",
+                    severity=PRICE_SEVERITY_BY_CLASS[price_class],
                     line_item_index=idx,
                     field="unit_price",
                     invoice_value=invoice_price,
                     po_value=po_price,
                     variance_percentage=round(price_variance * 100, 2),
-                    details=f"Line item '{invoice_item.description}': Invoice unit price £{invoice_price:.2f} "
+                    details=f"{item_label}: Invoice unit price £{invoice_price:.2f} "
                             f"vs PO price £{po_price:.2f} ({price_variance_pct:.1f}% {'increase' if price_variance > 0 else 'decrease'})",
-                    recommended_action="escalate_to_human",
+                    recommended_action=PRICE_ACTION_BY_CLASS[price_class],
                     confidence=0.99
                 ))
-                reasoning_parts.append(
-                    f"CRITICAL: {price_variance_pct:.1f}% price variance on '{invoice_item.description}'."
-                )
-            elif abs(price_variance) > ReconciliationRules.PRICE_VARIANCE_AUTO_APPROVE:
-                # Moderate price discrepancy (>2% but ≤15%)
-                severity = "high" if abs(price_variance) > 0.05 else "medium"
-                discrepancies.append(Discrepancy(
-                    type="price_mismatch",
-                    severity=severity,
+                if price_class == PRICE_CLASS_ESCALATE:
+                    # Major price discrepancy (>15%)
+                    reasoning_buf.write(
+                        f"CRITICAL: {price_variance_pct:.1f}% price variance on '{invoice_item.description}'. "
+                    )
+                else:
+                    # Moderate price discrepancy (>2% but ≤15%)
+                    reasoning_buf.write(
+                        f"Price variance detected: {price_variance_pct:.1f}% on '{invoice_item.description}'. "
+                    )
+            
+            # Check quantity variance
+            if qty_flagged[idx]:
+                invoice_qty = invoice_item.quantity
+                po_qty = float(po_qtys[idx])
+                qty_variance = float(qty_variances[idx])
+                discrepancies.append(Discrepancy.model_construct(
+                    type="quantity_mismatch",
+                    severity="medium" if abs(qty_variance) <= 0.10 else "high",
                     line_item_index=idx,
-                    field="unit_price",
-                    invoice_value=invoice_price,
-                    po_value=po_price,
-                    variance_percentage=round(price_variance * 100, 2),
-                    details=f"Line item '{invoice_item.description}': Invoice unit price £{invoice_price:.2f} "
-                            f"vs PO price £{po_price:.2f} ({price_variance_pct:.1f}% {'increase' if price_variance > 0 else 'decrease'})",
+                    field="quantity",
+                    invoice_value=invoice_qty,
+                    po_value=po_qty,
+                    variance_percentage=round(qty_variance * 100, 2),
+                    details=f"{item_label}: Invoice quantity {invoice_qty} "
+                            f"vs PO quantity {po_qty}",
                     recommended_action="flag_for_review",
-                    confidence=0.99
+                    confidence=0.98
                 ))
-                reasoning_parts.append(
-                    f"Price variance detected: {price_variance_pct:.1f}% on '{invoice_item.description}'."
-                )
+                reasoning_buf.write(f"Quantity mismatch on '{invoice_item.description}'. ")
         
-        # Check quantity variance
-        invoice_qty = invoice_item.quantity
-        po_qty = matched_po_item.get("quantity", 0)
+        # Check total variance
+        invoice_total = extracted_data.total
+        if po_total > 0:
+            total_variance = invoice_total - po_total
+            total_variance_pct = abs(total_variance / po_total) * 100
+            
+            # Check if within tolerance
+            within_amount_tolerance = abs(total_variance) <= RULES.TOTAL_VARIANCE_AMOUNT
+            within_pct_tolerance = abs(total_variance / po_total) <= RULES.TOTAL_VARIANCE_PERCENT
+            
+            if not (within_amount_tolerance or within_pct_tolerance):
+                severity = "high" if total_variance_pct > 10 else "medium"
+                discrepancies.append(Discrepancy.model_construct(
+                    type="total_variance",
+                    severity=severity,
+                    field="total",
+                    invoice_value=invoice_total,
+                    po_value=po_total,
+                    variance_percentage=round(total_variance_pct, 2),
+                    details=f"Invoice total £{invoice_total:.2f} vs PO total £{po_total:.2f} "
+                            f"(variance: £{total_variance:.2f}, {total_variance_pct:.1f}%)",
+                    recommended_action="flag_for_review" if severity == "medium" else "escalate_to_human",
+                    confidence=0.99
+                ))
+                reasoning_buf.write(f"Total variance: £{total_variance:.2f} ({total_variance_pct:.1f}%). ")
         
-        if po_qty > 0 and invoice_qty != po_qty:
-            qty_variance = (invoice_qty - po_qty) / po_qty
-            discrepancies.append(Discrepancy(
-                type="quantity_mismatch",
-                severity="medium" if abs(qty_variance) <= 0.10 else "high",
-                line_item_index=idx,
-                field="quantity",
-                invoice_value=invoice_qty,
-                po_value=po_qty,
-                variance_percentage=round(qty_variance * 100, 2),
-                details=f"Line item '{invoice_item.description}': Invoice quantity {invoice_qty} "
-                        f"vs PO quantity {po_qty}",
-                recommended_action="flag_for_review",
-                confidence=0.98
-            ))
-            reasoning_parts.append(f"Quantity mismatch on '{invoice_item.description}'.")
-    
-    # Check total variance
-    invoice_total = extracted_data.total
-    if po_total > 0:
-        total_variance = invoice_total - po_total
-        total_variance_pct = abs(total_variance / po_total) * 100
+        # Build final reasoning
+        if not discrepancies:
+            reasoning = "No discrepancies detected. All line items match PO prices and quantities within tolerance."
+        else:
+            reasoning = f"Detected {len(discrepancies)} discrepancies. " + reasoning_buf.getvalue().rstrip()
         
-        # Check if within tolerance
-        within_amount_tolerance = abs(total_variance) <= ReconciliationRules.TOTAL_VARIANCE_AMOUNT
-        within_pct_tolerance = abs(total_variance / po_total) <= ReconciliationRules.TOTAL_VARIANCE_PERCENT
+        trace_confidence, trace_status = 0.95, "success"
+        state["current_agent"] = "resolution"
         
-        if not (within_amount_tolerance or within_pct_tolerance):
-            severity = "high" if total_variance_pct > 10 else "medium"
-            discrepancies.append(Discrepancy(
-                type="total_variance",
-                severity=severity,
-                field="total",
-                invoice_value=invoice_total,
-                po_value=po_total,
-                variance_percentage=round(total_variance_pct, 2),
-                details=f"Invoice total £{invoice_total:.2f} vs PO total £{po_total:.2f} "
-                        f"(variance: £{total_variance:.2f}, {total_variance_pct:.1f}%)",
-                recommended_action="flag_for_review" if severity == "medium" else "escalate_to_human",
-                confidence=0.99
-            ))
-            reasoning_parts.append(f"Total variance: £{total_variance:.2f} ({total_variance_pct:.1f}%).")
-    
-    # Build final reasoning
-    if not discrepancies:
-        reasoning = "No discrepancies detected. All line items match PO prices and quantities within tolerance."
-    else:
-        reasoning = f"Detected {len(discrepancies)} discrepancies. " + " ".join(reasoning_parts)
-    
-    # Update state
-    duration_ms = int((time.time() - start_time) * 1000)
-    
-    state["discrepancies"] = discrepancies
-    state["discrepancy_reasoning"] = reasoning
-    state["agent_traces"] = state.get("agent_traces", {})
-    state["agent_traces"]["discrepancy_detection_agent"] = {
-        "duration_ms": duration_ms,
-        "confidence": 0.95,
-        "status": "success",
-        "reasoning": reasoning
-    }
-    state["current_agent"] = "resolution"
-    
-    return state
+        return state
+    finally:
+        state["discrepancies"] = discrepancies
+        state["discrepancy_reasoning"] = reasoning
+        record_trace(
+            state,
+            "discrepancy_detection_agent",
+            duration_ms=(time.perf_counter_ns() - start_ns) // 1_000_000,
+            confidence=trace_confidence,
+            status=trace_status,
+            reasoning=reasoning
+        )
@@ -1,20 +1,40 @@
 """Document Intelligence Agent - Extracts structured data from invoice PDFs."""
 
+import asyncio
+import hashlib
+import random
+import threading
 import time
 import base64
 import json
+from collections import OrderedDict
 from pathlib import Path
 from typing import Tuple, Optional
 import google.generativeai as genai
+from pydantic import ValidationError
 
-from src.core.config import GOOGLE_API_KEY, GEMINI_MODEL
-from src.core.state import AgentState
+from src.core.config import GEMINI_MODEL
+from src.core.state import AgentState, record_trace
 from src.models.schemas import ExtractedInvoice, LineItem
+from src.utils.extraction_cache import ExtractionCache
+from src.utils.gemini import (
+    JSON_GENERATION_CONFIG,
+    configure_gemini,
+    get_model,
+    parse_json_response,
+    strip_code_fences
+)
 
 
 # Configure Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
+configure_gemini()
 
+# Model config is fixed, so one instance is shared by every extraction call
+extraction_model = get_model(GEMINI_MODEL)
+
+
+# Bump whenever EXTRACTION_PROMPT changes so cached extractions are not reused
+PROMPT_VERSION = "v1"
 
 EXTRACTION_PROMPT = """You are an expert invoice data extraction agent. Extract all structured data from this invoice image/document.
 
@@ -57,24 +77,32 @@ CRITICAL RULES:
 Return ONLY the JSON object, no additional text or markdown formatting."""
 
 
+# Fields scored for extraction confidence and document quality
+CRITICAL_FIELDS = ("invoice_number", "supplier_name", "line_items", "total")
+OPTIONAL_FIELDS = (
+    "invoice_date", "po_reference", "subtotal", "vat_amount",
+    "currency", "payment_terms", "supplier_address", "bill_to"
+)
+
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp"
+}
+
+
 def get_mime_type(file_path: Path) -> str:
     """Get MIME type based on file extension."""
-    suffix = file_path.suffix.lower()
-    mime_types = {
-        ".pdf": "application/pdf",
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".gif": "image/gif",
-        ".webp": "image/webp"
-    }
-    return mime_types.get(suffix, "application/pdf")
+    return MIME_TYPES.get(file_path.suffix.lower(), "application/pdf")
 
 
 def assess_document_quality(confidence: float, extracted_data: dict) -> str:
     """Assess overall document quality based on extraction results."""
-    critical_fields = ["invoice_number", "supplier_name", "line_items", "total"]
-    missing_critical = sum(1 for f in critical_fields if not extracted_data.get(f))
+    missing_critical = sum(1 for f in CRITICAL_FIELDS if not extracted_data.get(f))
     
     if missing_critical == 0 and confidence >= 0.90:
         return "excellent"
@@ -86,169 +114,403 @@ def assess_document_quality(confidence: float, extracted_data: dict) -> str:
         return "poor"
 
 
+def parse_extraction_response(response_text: str) -> dict:
+    """
+    Parse a Gemini extraction response into a dict.
+    Raises json.JSONDecodeError if the response is not valid JSON.
+    """
+    # Strip markdown code fences (```json ... ```) if present
+    return parse_json_response(strip_code_fences(response_text))
+
+
+def score_extraction_confidence(extracted_data: dict) -> Tuple[float, str]:
+    """
+    Score an extraction's completeness. Pure function, no LLM involved.
+    Returns: (confidence, reasoning)
+    """
+    # Calculate confidence based on extracted fields with more realistic variation
+    critical_present = sum(1 for f in CRITICAL_FIELDS if extracted_data.get(f) not in (None, "", []))
+    optional_present = sum(1 for f in OPTIONAL_FIELDS if extracted_data.get(f) not in (None, "", []))
+    
+    # Base confidence from critical fields (major impact)
+    base_confidence = 0.60 + (critical_present / len(CRITICAL_FIELDS)) * 0.25
+    
+    # Boost from optional fields (smaller impact)
+    optional_boost = (optional_present / len(OPTIONAL_FIELDS)) * 0.10
+    
+    # Penalty for missing PO reference (common scenario)
+    po_penalty = 0.0 if extracted_data.get("po_reference") else -0.05
+    
+    # Slight variation based on line item count (more items = slightly lower confidence due to complexity)
+    line_items = extracted_data.get("line_items", [])
+    item_count = len(line_items) if line_items else 0
+    if item_count > 5:
+        item_penalty = -0.02 * min((item_count - 5), 3)  # Max -6%
+    else:
+        item_penalty = 0.0
+    
+    # Calculate final confidence with realistic range (75% - 96%)
+    confidence = base_confidence + optional_boost + po_penalty + item_penalty
+    # Clamp between 75% and 96%; deterministic so resolution thresholds are reproducible
+    confidence = round(max(0.75, min(0.96, confidence)), 2)
+    
+    reasoning = f"Successfully extracted invoice data using Gemini Vision. Found {item_count} line items. "
+    reasoning += f"Critical fields: {critical_present}/{len(CRITICAL_FIELDS)}, Optional: {optional_present}/{len(OPTIONAL_FIELDS)}. "
+    reasoning += f"PO ref present: {bool(extracted_data.get('po_reference'))}."
+    
+    return confidence, reasoning
+
+
+# Uploaded file state polling: start fast, back off up to a cap (seconds)
+FILE_POLL_INITIAL_DELAY = 0.1
+FILE_POLL_BACKOFF = 1.8
+FILE_POLL_MAX_DELAY = 2.0
+FILE_PROCESSING_TIMEOUT = 60
+
+# Successful extractions keyed by model, prompt version and file content hash:
+# an in-process LRU in front of the persistent on-disk cache
+EXTRACTION_CACHE_SIZE = 1000
+_extraction_cache: "OrderedDict[str, Tuple[dict, float, str]]" = OrderedDict()
+# Async lookups and inserts run in to_thread workers, concurrently with sync callers
+_extraction_cache_lock = threading.Lock()
+extraction_disk_cache = ExtractionCache()
+
+
+def _extraction_cache_key(file_path: Path) -> str:
+    """Cache key for a file: model, prompt version and SHA-256 of its contents."""
+    with open(file_path, "rb") as f:
+        content_hash = hashlib.sha256(f.read()).hexdigest()
+    return f"{GEMINI_MODEL}:{PROMPT_VERSION}:{content_hash}"
+
+
+def _get_cached_extraction(cache_key: str) -> Optional[Tuple[dict, float, str]]:
+    """Return a cached extraction result (memory, then disk) and mark it as recently used."""
+    with _extraction_cache_lock:
+        cached = _extraction_cache.get(cache_key)
+        if cached is not None:
+            _extraction_cache.move_to_end(cache_key)
+            return cached
+    
+    cached = extraction_disk_cache.get(cache_key)
+    if cached is not None:
+        _remember_extraction(cache_key, cached)
+    return cached
+
+
+def _remember_extraction(cache_key: str, result: Tuple[dict, float, str]) -> None:
+    """Store an extraction result in memory, evicting the oldest entry when full."""
+    with _extraction_cache_lock:
+        _extraction_cache[cache_key] = result
+        _extraction_cache.move_to_end(cache_key)
+        if len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+            _extraction_cache.popitem(last=False)
+
+
+def _cache_extraction(cache_key: str, result: Tuple[dict, float, str]) -> None:
+    """Store an extraction result in memory and on disk."""
+    _remember_extraction(cache_key, result)
+    extraction_disk_cache.set(cache_key, result)
+
+
+def _lookup_extraction(file_path: Path) -> Tuple[str, Optional[Tuple[dict, float, str]]]:
+    """Compute the cache key for a file and return it with any cached result."""
+    cache_key = _extraction_cache_key(file_path)
+    return cache_key, _get_cached_extraction(cache_key)
+
+
+def _is_rate_limit_error(error_msg: str) -> bool:
+    """Check whether a Gemini error message indicates rate limiting."""
+    return "429" in error_msg or "quota" in error_msg.lower() or "rate" in error_msg.lower()
+
+
+# Rate-limit backoff: exponential from the base up to the cap, plus up to one base of jitter (seconds)
+RATE_LIMIT_BACKOFF_BASE = 5.0
+RATE_LIMIT_BACKOFF_CAP = 60.0
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Return the server-suggested retry delay carried by a Gemini error, if any."""
+    # gRPC errors carry a google.rpc.RetryInfo detail
+    for detail in getattr(error, "details", None) or ():
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.ToTimedelta().total_seconds()
+    
+    # REST errors may carry a Retry-After header
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers:
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def _rate_limit_wait(attempt: int, error: Exception) -> float:
+    """
+    Seconds to wait before retrying a rate-limited call, preferring the server's hint.
+    The hint is clamped to the backoff range: daily-quota hints can be hours long, and a
+    zero delay would retry straight into the limit.
+    """
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        return min(max(retry_after, RATE_LIMIT_BACKOFF_BASE), RATE_LIMIT_BACKOFF_CAP)
+    backoff = min(RATE_LIMIT_BACKOFF_BASE * (2 ** attempt), RATE_LIMIT_BACKOFF_CAP)
+    # Jitter spreads out concurrent workers that were throttled together
+    return backoff + random.uniform(0, RATE_LIMIT_BACKOFF_BASE)
+
+
+# Corrective re-prompts when an extraction parses but does not fit ExtractedInvoice
+EXTRACTION_VALIDATION_RETRIES = 2
+
+# Validation errors the prompt itself allows: unclear fields come back null or are left out
+EXTRACTION_ALLOWED_ERROR_TYPES = {"missing"}
+
+
+def extraction_validation_feedback(extracted_data: dict) -> Optional[str]:
+    """
+    Validate a raw extraction against ExtractedInvoice, ignoring null or omitted fields
+    since EXTRACTION_PROMPT asks for null when a value is unclear.
+    Returns: a corrective message for Gemini, or None if there are no type or shape errors.
+    """
+    try:
+        ExtractedInvoice.model_validate(extracted_data)
+    except ValidationError as e:
+        errors = [
+            error for error in e.errors()
+            if error["type"] not in EXTRACTION_ALLOWED_ERROR_TYPES and error.get("input") is not None
+        ]
+        if errors:
+            return f"Your previous output had errors: {errors}. Return corrected JSON only."
+    return None
+
+
+def _validated_extraction_steps(uploaded_file):
+    """
+    Extraction conversation shared by the sync and async paths, as a generator.
+    Yields (delay_seconds, contents) for each Gemini call and is sent the response text back.
+    Keeps the last parseable result if Gemini cannot correct it; dict_to_extracted_invoice
+    then falls back to defaults as before.
+    Returns: (extracted_data_dict, confidence, reasoning) via StopIteration
+    """
+    response_text = yield 0.0, [EXTRACTION_PROMPT, uploaded_file]
+    extracted_data = parse_extraction_response(response_text)
+    
+    for attempt in range(EXTRACTION_VALIDATION_RETRIES):
+        corrective_msg = extraction_validation_feedback(extracted_data)
+        if corrective_msg is None:
+            break
+        response_text = yield 1.0 * (attempt + 1), [EXTRACTION_PROMPT, uploaded_file, corrective_msg]
+        try:
+            extracted_data = parse_extraction_response(response_text)
+        except json.JSONDecodeError:
+            break
+    
+    # Score only the extraction that is kept
+    confidence, reasoning = score_extraction_confidence(extracted_data)
+    return extracted_data, confidence, reasoning
+
+
+def _generate_validated_extraction(uploaded_file) -> Tuple[dict, float, str]:
+    """
+    Run extraction on an uploaded file, re-prompting with validation errors if needed.
+    Returns: (extracted_data_dict, confidence, reasoning)
+    """
+    steps = _validated_extraction_steps(uploaded_file)
+    delay, contents = next(steps)
+    while True:
+        if delay:
+            time.sleep(delay)
+        response = extraction_model.generate_content(contents, generation_config=JSON_GENERATION_CONFIG)
+        try:
+            delay, contents = steps.send(response.text)
+        except StopIteration as done:
+            return done.value
+
+
+async def _generate_validated_extraction_async(uploaded_file) -> Tuple[dict, float, str]:
+    """Async variant of _generate_validated_extraction."""
+    steps = _validated_extraction_steps(uploaded_file)
+    delay, contents = next(steps)
+    while True:
+        if delay:
+            await asyncio.sleep(delay)
+        response = await extraction_model.generate_content_async(contents, generation_config=JSON_GENERATION_CONFIG)
+        try:
+            delay, contents = steps.send(response.text)
+        except StopIteration as done:
+            return done.value
+
+
+def _upload_for_extraction(file_path: Path):
+    """Upload a file to the Gemini File API and wait until it is ready."""
+    uploaded_file = genai.upload_file(str(file_path))
+    
+    # Wait for file to be processed, backing off between polls
+    poll_delay = FILE_POLL_INITIAL_DELAY
+    deadline = time.monotonic() + FILE_PROCESSING_TIMEOUT
+    while uploaded_file.state.name == "PROCESSING":
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Uploaded file still processing after {FILE_PROCESSING_TIMEOUT}s")
+        time.sleep(poll_delay)
+        poll_delay = min(poll_delay * FILE_POLL_BACKOFF, FILE_POLL_MAX_DELAY)
+        uploaded_file = genai.get_file(uploaded_file.name)
+    
+    return uploaded_file
+
+
+async def _upload_for_extraction_async(file_path: Path):
+    """Async variant of _upload_for_extraction; the File API has no async client."""
+    uploaded_file = await asyncio.to_thread(genai.upload_file, str(file_path))
+    
+    poll_delay = FILE_POLL_INITIAL_DELAY
+    deadline = time.monotonic() + FILE_PROCESSING_TIMEOUT
+    while uploaded_file.state.name == "PROCESSING":
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Uploaded file still processing after {FILE_PROCESSING_TIMEOUT}s")
+        await asyncio.sleep(poll_delay)
+        poll_delay = min(poll_delay * FILE_POLL_BACKOFF, FILE_POLL_MAX_DELAY)
+        uploaded_file = await asyncio.to_thread(genai.get_file, uploaded_file.name)
+    
+    return uploaded_file
+
+
 def extract_with_gemini(file_path: Path, max_retries: int = 3) -> Tuple[Optional[dict], float, str]:
     """
     Extract invoice data using Gemini Vision with retry logic.
+    Identical files are served from the content-hash cache without calling Gemini.
+    The file is uploaded once and the handle is reused across rate-limit retries.
     Returns: (extracted_data_dict, confidence, reasoning)
     """
-    for attempt in range(max_retries):
-        try:
-            # Upload the file using Gemini File API
-            uploaded_file = genai.upload_file(str(file_path))
-            
-            # Wait for file to be processed
-            while uploaded_file.state.name == "PROCESSING":
-                time.sleep(1)
-                uploaded_file = genai.get_file(uploaded_file.name)
-            
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            
-            # Generate content with the uploaded file
-            response = model.generate_content([
-                EXTRACTION_PROMPT,
-                uploaded_file
-            ])
-            
-            # Clean up uploaded file
+    cache_key, cached = _lookup_extraction(file_path)
+    if cached is not None:
+        return cached
+    
+    uploaded_file = None
+    try:
+        for attempt in range(max_retries):
+            try:
+                if uploaded_file is None:
+                    uploaded_file = _upload_for_extraction(file_path)
+                
+                # Generate content with the uploaded file
+                result = _generate_validated_extraction(uploaded_file)
+                _cache_extraction(cache_key, result)
+                return result
+                
+            except json.JSONDecodeError as e:
+                return None, 0.0, f"Failed to parse Gemini response as JSON: {str(e)}"
+            except Exception as e:
+                error_msg = str(e)
+                # Check if it's a rate limit error
+                if _is_rate_limit_error(error_msg):
+                    if attempt < max_retries - 1:
+                        # Wait and retry with jittered exponential backoff
+                        wait_time = _rate_limit_wait(attempt, e)
+                        print(f"Rate limited, waiting {wait_time:.1f}s before retry {attempt + 2}/{max_retries}...")
+                        time.sleep(wait_time)
+                        continue
+                return None, 0.0, f"Gemini extraction failed: {error_msg}"
+        
+        return None, 0.0, "Extraction failed after all retries"
+    finally:
+        # Clean up uploaded file
+        if uploaded_file is not None:
             try:
                 genai.delete_file(uploaded_file.name)
             except:
                 pass
-            
-            # Parse the response
-            response_text = response.text.strip()
-            
-            # Clean up response if it has markdown code blocks
-            if response_text.startswith("```"):
-                lines = response_text.split("\n")
-                # Find the closing ``` and remove both
-                if lines[-1].strip() == "```":
-                    response_text = "\n".join(lines[1:-1])
-                else:
-                    response_text = "\n".join(lines[1:])
-            
-            # Also handle ```json prefix
-            if response_text.startswith("json"):
-                response_text = response_text[4:].strip()
-            
-            extracted_data = json.loads(response_text)
-            
-            # Calculate confidence based on extracted fields with more realistic variation
-            critical_fields = [
-                extracted_data.get("invoice_number"),
-                extracted_data.get("supplier_name"),
-                extracted_data.get("line_items"),
-                extracted_data.get("total")
-            ]
-            optional_fields = [
-                extracted_data.get("invoice_date"),
-                extracted_data.get("po_reference"),
-                extracted_data.get("subtotal"),
-                extracted_data.get("vat_amount"),
-                extracted_data.get("currency"),
-                extracted_data.get("payment_terms"),
-                extracted_data.get("supplier_address"),
-                extracted_data.get("bill_to")
-            ]
-            
-            # Count present fields
-            critical_present = sum(1 for v in critical_fields if v is not None and v != "" and v != [])
-            optional_present = sum(1 for v in optional_fields if v is not None and v != "" and v != [])
-            
-            # Base confidence from critical fields (major impact)
-            base_confidence = 0.60 + (critical_present / 4) * 0.25
-            
-            # Boost from optional fields (smaller impact)
-            optional_boost = (optional_present / 8) * 0.10
-            
-            # Penalty for missing PO reference (common scenario)
-            po_penalty = 0.0 if extracted_data.get("po_reference") else -0.05
-            
-            # Slight variation based on line item count (more items = slightly lower confidence due to complexity)
-            line_items = extracted_data.get("line_items", [])
-            item_count = len(line_items) if line_items else 0
-            if item_count > 5:
-                item_penalty = -0.02 * min((item_count - 5), 3)  # Max -6%
-            else:
-                item_penalty = 0.0
-            
-            # Calculate final confidence with realistic range (75% - 96%)
-            confidence = base_confidence + optional_boost + po_penalty + item_penalty
-            confidence = max(0.75, min(0.96, confidence))  # Clamp between 75% and 96%
-            
-            # Round to make it look more natural (not always exact numbers)
-            import random
-            natural_variance = random.uniform(-0.02, 0.02)
-            confidence = round(confidence + natural_variance, 2)
-            confidence = max(0.72, min(0.97, confidence))
-            
-            reasoning = f"Successfully extracted invoice data using Gemini Vision. Found {item_count} line items. "
-            reasoning += f"Critical fields: {critical_present}/4, Optional: {optional_present}/8. "
-            reasoning += f"PO ref present: {bool(extracted_data.get('po_reference'))}."
-            
-            return extracted_data, confidence, reasoning
-            
-        except json.JSONDecodeError as e:
-            return None, 0.0, f"Failed to parse Gemini response as JSON: {str(e)}"
-        except Exception as e:
-            error_msg = str(e)
-            # Check if it's a rate limit error
-            if "429" in error_msg or "quota" in error_msg.lower() or "rate" in error_msg.lower():
-                if attempt < max_retries - 1:
-                    # Wait and retry with exponential backoff
-                    wait_time = (attempt + 1) * 30  # 30s, 60s, 90s
-                    print(f"Rate limited, waiting {wait_time}s before retry {attempt + 2}/{max_retries}...")
-                    time.sleep(wait_time)
-                    continue
-            return None, 0.0, f"Gemini extraction failed: {error_msg}"
+
+
+async def extract_with_gemini_async(file_path: Path, max_retries: int = 3) -> Tuple[Optional[dict], float, str]:
+    """
+    Async variant of extract_with_gemini so several invoices can be in flight at once.
+    The File API has no async client, so its calls run in worker threads.
+    Returns: (extracted_data_dict, confidence, reasoning)
+    """
+    cache_key, cached = await asyncio.to_thread(_lookup_extraction, file_path)
+    if cached is not None:
+        return cached
     
-    return None, 0.0, "Extraction failed after all retries"
+    uploaded_file = None
+    try:
+        for attempt in range(max_retries):
+            try:
+                if uploaded_file is None:
+                    uploaded_file = await _upload_for_extraction_async(file_path)
+                
+                result = await _generate_validated_extraction_async(uploaded_file)
+                # The disk write (temp file + rename) stays off the event loop
+                await asyncio.to_thread(_cache_extraction, cache_key, result)
+                return result
+                
+            except json.JSONDecodeError as e:
+                return None, 0.0, f"Failed to parse Gemini response as JSON: {str(e)}"
+            except Exception as e:
+                error_msg = str(e)
+                if _is_rate_limit_error(error_msg):
+                    if attempt < max_retries - 1:
+                        wait_time = _rate_limit_wait(attempt, e)
+                        print(f"Rate limited, waiting {wait_time:.1f}s before retry {attempt + 2}/{max_retries}...")
+                        await asyncio.sleep(wait_time)
+                        continue
+                return None, 0.0, f"Gemini extraction failed: {error_msg}"
+        
+        return None, 0.0, "Extraction failed after all retries"
+    finally:
+        if uploaded_file is not None:
+            try:
+                await asyncio.to_thread(genai.delete_file, uploaded_file.name)
+            except:
+                pass
 
 
 def dict_to_extracted_invoice(data: dict) -> ExtractedInvoice:
-    """Convert extracted dict to Pydantic model."""
-    line_items = []
-    for item in data.get("line_items", []):
-        line_items.append(LineItem(
+    """
+    Convert extracted dict to Pydantic model.
+    Values are coerced here, so models are built with model_construct to skip re-validation.
+    """
+    line_items = [
+        LineItem.model_construct(
             item_code=item.get("item_code"),
-            description=item.get("description", "Unknown"),
-            quantity=float(item.get("quantity", 0)),
-            unit=item.get("unit", "kg"),
-            unit_price=float(item.get("unit_price", 0)),
-            line_total=float(item.get("line_total", 0)),
+            description=item.get("description") or "Unknown",
+            quantity=float(item.get("quantity") or 0),
+            unit=item.get("unit") or "kg",
+            unit_price=float(item.get("unit_price") or 0),
+            line_total=float(item.get("line_total") or 0),
             extraction_confidence=0.95
-        ))
+        )
+        for item in data.get("line_items") or []
+    ]
     
-    return ExtractedInvoice(
-        invoice_number=data.get("invoice_number", "UNKNOWN"),
-        invoice_date=data.get("invoice_date", ""),
-        supplier_name=data.get("supplier_name", "Unknown Supplier"),
+    vat_rate = data.get("vat_rate")
+    
+    return ExtractedInvoice.model_construct(
+        invoice_number=data.get("invoice_number") or "UNKNOWN",
+        invoice_date=data.get("invoice_date") or "",
+        supplier_name=data.get("supplier_name") or "Unknown Supplier",
         supplier_address=data.get("supplier_address"),
         supplier_vat=data.get("supplier_vat"),
         po_reference=data.get("po_reference"),
         payment_terms=data.get("payment_terms"),
         bill_to=data.get("bill_to"),
         line_items=line_items,
-        subtotal=float(data.get("subtotal", 0)),
-        vat_rate=float(data.get("vat_rate", 0.20)),
-        vat_amount=float(data.get("vat_amount", 0)),
-        total=float(data.get("total", 0)),
-        currency=data.get("currency", "GBP")
+        subtotal=float(data.get("subtotal") or 0),
+        vat_rate=float(vat_rate) if vat_rate is not None else 0.20,
+        vat_amount=float(data.get("vat_amount") or 0),
+        total=float(data.get("total") or 0),
+        currency=data.get("currency") or "GBP"
     )
 
 
-def document_intelligence_agent(state: AgentState) -> AgentState:
-    """
-    Document Intelligence Agent node for LangGraph.
-    Extracts structured data from invoice PDF/image.
-    """
-    start_time = time.time()
-    
-    invoice_path = Path(state["invoice_path"])
-    
-    # Extract using Gemini with retry logic
-    extracted_dict, confidence, reasoning = extract_with_gemini(invoice_path)
-    
+def _apply_extraction_result(
+    state: AgentState,
+    start_time: float,
+    extracted_dict: Optional[dict],
+    confidence: float,
+    reasoning: str
+) -> AgentState:
+    """Record an extraction result (or failure) on the workflow state."""
     if extracted_dict is None:
         # Extraction failed
         duration_ms = int((time.time() - start_time) * 1000)
@@ -256,13 +518,14 @@ def document_intelligence_agent(state: AgentState) -> AgentState:
         state["extraction_confidence"] = 0.0
         state["document_quality"] = "poor"
         state["extraction_reasoning"] = reasoning
-        state["agent_traces"] = state.get("agent_traces", {})
-        state["agent_traces"]["document_intelligence_agent"] = {
-            "duration_ms": duration_ms,
-            "confidence": 0.0,
-            "status": "failed",
-            "reasoning": reasoning
-        }
+        record_trace(
+            state,
+            "document_intelligence_agent",
+            duration_ms=duration_ms,
+            confidence=0.0,
+            status="failed",
+            reasoning=reasoning
+        )
         return state
     
     # Convert to Pydantic model
@@ -276,13 +539,43 @@ def document_intelligence_agent(state: AgentState) -> AgentState:
     state["extraction_confidence"] = confidence
     state["document_quality"] = document_quality
     state["extraction_reasoning"] = reasoning
-    state["agent_traces"] = state.get("agent_traces", {})
-    state["agent_traces"]["document_intelligence_agent"] = {
-        "duration_ms": duration_ms,
-        "confidence": confidence,
-        "status": "success",
-        "reasoning": reasoning
-    }
+    record_trace(
+        state,
+        "document_intelligence_agent",
+        duration_ms=duration_ms,
+        confidence=confidence,
+        status="success",
+        reasoning=reasoning
+    )
     state["current_agent"] = "matching"
     
     return state
+
+
+def document_intelligence_agent(state: AgentState) -> AgentState:
+    """
+    Document Intelligence Agent node for LangGraph.
+    Extracts structured data from invoice PDF/image.
+    """
+    start_time = time.time()
+    
+    invoice_path = Path(state["invoice_path"])
+    
+    # Extract using Gemini with retry logic
+    extracted_dict, confidence, reasoning = extract_with_gemini(invoice_path)
+    
+    return _apply_extraction_result(state, start_time, extracted_dict, confidence, reasoning)
+
+
+async def document_intelligence_agent_async(state: AgentState) -> AgentState:
+    """
+    Async Document Intelligence Agent node, used when the workflow runs via ainvoke.
+    """
+    start_time = time.time()
+    
+    invoice_path = Path(state["invoice_path"])
+    
+    extracted_dict, confidence, reasoning = await extract_with_gemini_async(invoice_path)
+    
+    return _apply_extraction_result(state, start_time, extracted_dict, confidence, reasoning)
+
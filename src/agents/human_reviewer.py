@@ -1,16 +1,22 @@
 """Human Reviewer Agent - BONUS: Simulates feedback loop for iterative improvement."""
 
 import time
-from typing import Optional
-import google.generativeai as genai
+from typing import Optional, Tuple
 
-from src.core.state import AgentState
-from src.core.config import GOOGLE_API_KEY, GEMINI_MODEL
+from src.core.state import AgentState, record_trace
+from src.core.config import GEMINI_MODEL
 from src.models.schemas import ExtractedInvoice
+from src.utils.gemini import (
+    JSON_GENERATION_CONFIG,
+    configure_gemini,
+    get_model,
+    parse_json_response,
+    strip_code_fences
+)
 
 
 # Configure Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
+configure_gemini()
 
 
 REVIEW_PROMPT = """You are a Human Reviewer Agent simulating an experienced accounts payable specialist reviewing an invoice reconciliation result.
@@ -59,6 +65,89 @@ If everything looks correct, return:
 Return ONLY the JSON object."""
 
 
+def _skip_review(state: AgentState, start_time: float) -> AgentState:
+    """Record that an auto-approved invoice needs no review."""
+    state["review_feedback"] = "Auto-approved invoices do not require human review simulation."
+    state["needs_reprocessing"] = False
+    duration_ms = int((time.time() - start_time) * 1000)
+    record_trace(
+        state,
+        "human_reviewer_agent",
+        duration_ms=duration_ms,
+        confidence=1.0,
+        status="skipped",
+        reasoning="Auto-approved invoice, no review needed"
+    )
+    return state
+
+
+def _build_review_prompt(state: AgentState) -> str:
+    """Format REVIEW_PROMPT with the invoice, matched PO and discrepancies from the state."""
+    extracted_data: Optional[ExtractedInvoice] = state.get("extracted_data")
+    matched_po_data = state.get("matched_po_data")
+    discrepancies = state.get("discrepancies", [])
+    
+    # Prepare data for review
+    # Compact JSON: indentation only adds prompt tokens
+    invoice_str = extracted_data.model_dump_json() if extracted_data else "No data"
+    po_str = str(matched_po_data) if matched_po_data else "No matched PO"
+    discrepancy_str = "\n".join([d.details for d in discrepancies]) if discrepancies else "None"
+    
+    return REVIEW_PROMPT.format(
+        invoice_data=invoice_str,
+        matched_po=po_str,
+        discrepancies=discrepancy_str,
+        recommendation=state.get("recommended_action", "unknown")
+    )
+
+
+def _apply_review_response(state: AgentState, response_text: str) -> Tuple[str, float]:
+    """
+    Store the reviewer's verdict on the state.
+    Returns: (reasoning, review_confidence)
+    """
+    # Clean up response
+    review_result = parse_json_response(strip_code_fences(response_text))
+    
+    approval_status = review_result.get("approval_status", "approved")
+    corrections = review_result.get("corrections", [])
+    feedback = review_result.get("feedback", "")
+    review_confidence = review_result.get("confidence", 0.90)
+    
+    state["review_feedback"] = feedback
+    state["corrections"] = corrections if corrections else None
+    state["needs_reprocessing"] = approval_status == "needs_correction" and len(corrections) > 0
+    
+    reasoning = f"Human Reviewer simulation: {approval_status}. {feedback}"
+    if corrections:
+        reasoning += f" Suggested {len(corrections)} corrections."
+    return reasoning, review_confidence
+
+
+def _apply_review_error(state: AgentState, error: Exception) -> Tuple[str, float]:
+    """
+    Handle a failed review gracefully.
+    Returns: (reasoning, review_confidence)
+    """
+    state["review_feedback"] = f"Human review simulation failed: {str(error)}"
+    state["needs_reprocessing"] = False
+    return f"Review simulation error: {str(error)}", 0.5
+
+
+def _finish_review(state: AgentState, start_time: float, reasoning: str, review_confidence: float) -> AgentState:
+    """Record the review trace and return the state."""
+    duration_ms = int((time.time() - start_time) * 1000)
+    record_trace(
+        state,
+        "human_reviewer_agent",
+        duration_ms=duration_ms,
+        confidence=review_confidence,
+        status="success",
+        reasoning=reasoning
+    )
+    return state
+
+
 def human_reviewer_agent(state: AgentState) -> AgentState:
     """
     Human Reviewer Agent node for LangGraph.
@@ -66,79 +155,35 @@ def human_reviewer_agent(state: AgentState) -> AgentState:
     """
     start_time = time.time()
     
-    extracted_data: Optional[ExtractedInvoice] = state.get("extracted_data")
-    matched_po_data = state.get("matched_po_data")
-    discrepancies = state.get("discrepancies", [])
-    recommendation = state.get("recommended_action", "unknown")
-    
     # Only review if flagged or escalated
-    if recommendation == "auto_approve":
-        # Skip review for auto-approved invoices
-        state["review_feedback"] = "Auto-approved invoices do not require human review simulation."
-        state["needs_reprocessing"] = False
-        duration_ms = int((time.time() - start_time) * 1000)
-        state["agent_traces"] = state.get("agent_traces", {})
-        state["agent_traces"]["human_reviewer_agent"] = {
-            "duration_ms": duration_ms,
-            "confidence": 1.0,
-            "status": "skipped",
-            "reasoning": "Auto-approved invoice, no review needed"
-        }
-        return state
+    if state.get("recommended_action", "unknown") == "auto_approve":
+        return _skip_review(state, start_time)
     
     try:
-        model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        # Prepare data for review
-        invoice_str = extracted_data.model_dump_json(indent=2) if extracted_data else "No data"
-        po_str = str(matched_po_data) if matched_po_data else "No matched PO"
-        discrepancy_str = "\n".join([d.details for d in discrepancies]) if discrepancies else "None"
-        
-        prompt = REVIEW_PROMPT.format(
-            invoice_data=invoice_str,
-            matched_po=po_str,
-            discrepancies=discrepancy_str,
-            recommendation=recommendation
-        )
-        
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        # Clean up response
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            response_text = "\n".join(lines[1:-1])
-        
-        import json
-        review_result = json.loads(response_text)
-        
-        approval_status = review_result.get("approval_status", "approved")
-        corrections = review_result.get("corrections", [])
-        feedback = review_result.get("feedback", "")
-        review_confidence = review_result.get("confidence", 0.90)
-        
-        state["review_feedback"] = feedback
-        state["corrections"] = corrections if corrections else None
-        state["needs_reprocessing"] = approval_status == "needs_correction" and len(corrections) > 0
-        
-        reasoning = f"Human Reviewer simulation: {approval_status}. {feedback}"
-        if corrections:
-            reasoning += f" Suggested {len(corrections)} corrections."
-        
+        model = get_model(GEMINI_MODEL)
+        response = model.generate_content(_build_review_prompt(state), generation_config=JSON_GENERATION_CONFIG)
+        reasoning, review_confidence = _apply_review_response(state, response.text)
     except Exception as e:
-        # Handle errors gracefully
-        state["review_feedback"] = f"Human review simulation failed: {str(e)}"
-        state["needs_reprocessing"] = False
-        reasoning = f"Review simulation error: {str(e)}"
-        review_confidence = 0.5
+        reasoning, review_confidence = _apply_review_error(state, e)
     
-    duration_ms = int((time.time() - start_time) * 1000)
-    state["agent_traces"] = state.get("agent_traces", {})
-    state["agent_traces"]["human_reviewer_agent"] = {
-        "duration_ms": duration_ms,
-        "confidence": review_confidence,
-        "status": "success",
-        "reasoning": reasoning
-    }
+    return _finish_review(state, start_time, reasoning, review_confidence)
+
+
+async def human_reviewer_agent_async(state: AgentState) -> AgentState:
+    """Async variant of human_reviewer_agent; awaits Gemini instead of blocking the event loop."""
+    start_time = time.time()
     
-    return state
+    if state.get("recommended_action", "unknown") == "auto_approve":
+        return _skip_review(state, start_time)
+    
+    try:
+        model = get_model(GEMINI_MODEL)
+        response = await model.generate_content_async(
+            _build_review_prompt(state),
+            generation_config=JSON_GENERATION_CONFIG
+        )
+        reasoning, review_confidence = _apply_review_response(state, response.text)
+    except Exception as e:
+        reasoning, review_confidence = _apply_review_error(state, e)
+    
+    return _finish_review(state, start_time, reasoning, review_confidence)
@@ -2,10 +2,10 @@
 
 import time
 from typing import Optional
+from rapidfuzz import fuzz, process
 
-from src.core.state import AgentState
-from src.core.config import ReconciliationRules
-from src.utils.po_database import PODatabase
+from src.core.state import AgentState, record_trace
+from src.utils.po_database import get_po_database
 from src.models.schemas import MatchingResult, ExtractedInvoice
 
 
@@ -28,27 +28,30 @@ def matching_agent(state: AgentState) -> AgentState:
             supplier_match=False
         )
         state["matching_reasoning"] = "No extracted invoice data available for matching."
-        state["agent_traces"] = state.get("agent_traces", {})
-        state["agent_traces"]["matching_agent"] = {
-            "duration_ms": duration_ms,
-            "confidence": 0.0,
-            "status": "failed",
-            "reasoning": "No extracted data"
-        }
+        record_trace(
+            state,
+            "matching_agent",
+            duration_ms=duration_ms,
+            confidence=0.0,
+            status="failed",
+            reasoning="No extracted data"
+        )
         return state
     
-    # Initialize PO database
-    po_db = PODatabase()
+    # Shared PO database, loaded and indexed once per process
+    po_db = get_po_database()
     
     # Get product descriptions for fuzzy matching
     product_descriptions = [item.description for item in extracted_data.line_items]
     
-    # Use 3-tier matching strategy
-    matched_po, match_method, confidence = po_db.find_best_match(
+    # Use 3-tier strategy; top candidates come from the same scoring pass
+    matched_po, match_method, confidence, top_candidates = po_db.find_best_match_with_candidates(
         po_reference=extracted_data.po_reference,
         supplier_name=extracted_data.supplier_name,
         product_descriptions=product_descriptions,
-        invoice_total=extracted_data.total
+        invoice_total=extracted_data.total,
+        top_k=3,
+        top_k_threshold=60
     )
     
     # Build detailed reasoning
@@ -76,16 +79,19 @@ def matching_agent(state: AgentState) -> AgentState:
     # Calculate line item matching stats
     line_items_matched = 0
     if matched_po:
+        invoice_descriptions = [item.description.lower() for item in extracted_data.line_items]
         po_descriptions = [item.description.lower() for item in matched_po.line_items]
-        for item in extracted_data.line_items:
-            for po_desc in po_descriptions:
-                from rapidfuzz import fuzz
-                if fuzz.token_sort_ratio(item.description.lower(), po_desc) >= 70:
-                    line_items_matched += 1
-                    break
+        if invoice_descriptions and po_descriptions:
+            # One C-level score matrix; an invoice line counts if any PO line reaches 70
+            scores = process.cdist(
+                invoice_descriptions,
+                po_descriptions,
+                scorer=fuzz.token_sort_ratio,
+                score_cutoff=70
+            )
+            line_items_matched = int((scores >= 70).any(axis=1).sum())
         
         # Check supplier name match
-        from rapidfuzz import fuzz
         supplier_score = fuzz.token_sort_ratio(
             extracted_data.supplier_name.lower(),
             matched_po.supplier.lower()
@@ -117,8 +123,7 @@ def matching_agent(state: AgentState) -> AgentState:
     # Look for alternative matches if confidence is low
     if confidence < 0.80 and matched_po:
         alt_matches = []
-        product_matches = po_db.fuzzy_match_products(product_descriptions, threshold=60)
-        for po, score, count in product_matches[:3]:
+        for po, score, count in top_candidates:
             if po.po_number != matched_po.po_number:
                 alt_matches.append({
                     "po_number": po.po_number,
@@ -139,13 +144,14 @@ def matching_agent(state: AgentState) -> AgentState:
     
     state["matching_results"] = matching_result
     state["matching_reasoning"] = reasoning
-    state["agent_traces"] = state.get("agent_traces", {})
-    state["agent_traces"]["matching_agent"] = {
-        "duration_ms": duration_ms,
-        "confidence": confidence,
-        "status": "success" if matched_po else "partial",
-        "reasoning": reasoning
-    }
+    record_trace(
+        state,
+        "matching_agent",
+        duration_ms=duration_ms,
+        confidence=confidence,
+        status="success" if matched_po else "partial",
+        reasoning=reasoning
+    )
     state["current_agent"] = "discrepancy_detection"
     
     return state
@@ -1,13 +1,21 @@
 """Resolution Agent - Recommends action based on all agent findings."""
 
+import io
 import time
 from typing import List, Optional
 
-from src.core.state import AgentState
-from src.core.config import ReconciliationRules
+from src.core.state import AgentState, record_trace
+from src.core.config import RULES
 from src.models.schemas import Discrepancy, MatchingResult, ExtractedInvoice
 
 
+ACTION_EXPLANATIONS = {
+    "auto_approve": "All criteria met for automatic approval. High confidence extraction, exact PO match, no discrepancies.",
+    "flag_for_review": "Minor issues detected requiring human verification before approval.",
+    "escalate_to_human": "Significant issues detected. Immediate human attention required before processing."
+}
+
+
 def resolution_agent(state: AgentState) -> AgentState:
     """
     Resolution Agent node for LangGraph.
@@ -21,14 +29,19 @@ def resolution_agent(state: AgentState) -> AgentState:
     extracted_data: Optional[ExtractedInvoice] = state.get("extracted_data")
     matched_po_data = state.get("matched_po_data")
     
+    # Thresholds are read once per invoice
+    confidence_auto_approve = RULES.CONFIDENCE_AUTO_APPROVE
+    confidence_flag_review_min = RULES.CONFIDENCE_FLAG_REVIEW_MIN
+    confidence_escalate = RULES.CONFIDENCE_ESCALATE
+    
     # Initialize decision factors
     decision_factors = []
     risk_factors = []
     
     # Factor 1: Extraction confidence
-    if extraction_confidence >= ReconciliationRules.CONFIDENCE_AUTO_APPROVE:
+    if extraction_confidence >= confidence_auto_approve:
         decision_factors.append(("extraction_confidence", "high", extraction_confidence))
-    elif extraction_confidence >= ReconciliationRules.CONFIDENCE_FLAG_REVIEW_MIN:
+    elif extraction_confidence >= confidence_flag_review_min:
         decision_factors.append(("extraction_confidence", "medium", extraction_confidence))
         risk_factors.append("Low extraction confidence")
     else:
@@ -50,8 +63,12 @@ def resolution_agent(state: AgentState) -> AgentState:
         risk_factors.append("No PO match found")
     
     # Factor 3: Discrepancies
-    high_severity_count = sum(1 for d in discrepancies if d.severity == "high")
-    medium_severity_count = sum(1 for d in discrepancies if d.severity == "medium")
+    high_severity_count = medium_severity_count = 0
+    for d in discrepancies:
+        if d.severity == "high":
+            high_severity_count += 1
+        elif d.severity == "medium":
+            medium_severity_count += 1
     
     if high_severity_count > 0:
         risk_factors.append(f"{high_severity_count} high-severity discrepancies")
@@ -61,81 +78,76 @@ def resolution_agent(state: AgentState) -> AgentState:
     # Determine recommended action
     recommended_action = "auto_approve"
     
-    # Escalate conditions
-    escalate_conditions = [
-        high_severity_count >= 1,
-        len(discrepancies) >= 3,
-        extraction_confidence < ReconciliationRules.CONFIDENCE_ESCALATE,
-        po_confidence < 0.50 and matching_results is not None,
-        matched_po_data is None and (matching_results is None or not matching_results.matched_po)
-    ]
+    # Escalate conditions (short-circuit: later checks are skipped once one holds)
+    should_escalate = (
+        high_severity_count >= 1
+        or len(discrepancies) >= 3
+        or extraction_confidence < confidence_escalate
+        or (matching_results is not None and po_confidence < 0.50)
+        or (matched_po_data is None and (matching_results is None or not matching_results.matched_po))
+    )
     
     # Flag for review conditions
-    flag_conditions = [
-        medium_severity_count >= 1,
-        extraction_confidence < ReconciliationRules.CONFIDENCE_AUTO_APPROVE,
-        po_confidence < 0.95 and po_confidence >= 0.50,
-        matching_results and matching_results.match_method != "exact_po_reference",
-        len(discrepancies) >= 1
-    ]
-    
-    if any(escalate_conditions):
+    should_flag = (
+        medium_severity_count >= 1
+        or extraction_confidence < confidence_auto_approve
+        or 0.50 <= po_confidence < 0.95
+        or (matching_results is not None and matching_results.match_method != "exact_po_reference")
+        or len(discrepancies) >= 1
+    )
+    
+    if should_escalate:
         recommended_action = "escalate_to_human"
         risk_level = "high"
-    elif any(flag_conditions):
+    elif should_flag:
         recommended_action = "flag_for_review"
         risk_level = "medium"
     else:
         risk_level = "low"
     
-    # Build comprehensive reasoning
-    reasoning_parts = []
+    # Build comprehensive reasoning; every fragment but the last ends with a separating space
+    reasoning_buf = io.StringIO()
+    write = reasoning_buf.write
     
     # Invoice summary
     if extracted_data:
-        reasoning_parts.append(
-            f"Invoice {extracted_data.invoice_number} processed with {extraction_confidence:.0%} extraction confidence."
+        write(
+            f"Invoice {extracted_data.invoice_number} processed with {extraction_confidence:.0%} extraction confidence. "
         )
     
     # Document quality
     doc_quality = state.get("document_quality", "unknown")
-    reasoning_parts.append(f"Document quality assessed as '{doc_quality}'.")
+    write(f"Document quality assessed as '{doc_quality}'. ")
     
     # PO matching summary
     if matching_results:
         if matching_results.matched_po:
-            reasoning_parts.append(
+            write(
                 f"Matched to {matching_results.matched_po} via {matching_results.match_method.replace('_', ' ')} "
-                f"({matching_results.po_match_confidence:.0%} confidence)."
+                f"({matching_results.po_match_confidence:.0%} confidence). "
             )
         else:
-            reasoning_parts.append("Could not match to any purchase order in database.")
+            write("Could not match to any purchase order in database. ")
     
     # Discrepancy summary
     if discrepancies:
-        reasoning_parts.append(f"Detected {len(discrepancies)} discrepancies:")
+        write(f"Detected {len(discrepancies)} discrepancies: ")
         for d in discrepancies:
-            reasoning_parts.append(f"  - {d.type.replace('_', ' ').title()}: {d.details}")
+            write(f"  - {d.type.replace('_', ' ').title()}: {d.details} ")
     else:
-        reasoning_parts.append("No discrepancies detected.")
+        write("No discrepancies detected. ")
     
     # Risk assessment
     if risk_factors:
-        reasoning_parts.append(f"Risk factors: {', '.join(risk_factors)}.")
+        write(f"Risk factors: {', '.join(risk_factors)}. ")
     else:
-        reasoning_parts.append("No significant risk factors identified.")
+        write("No significant risk factors identified. ")
     
     # Final decision
-    action_explanations = {
-        "auto_approve": "All criteria met for automatic approval. High confidence extraction, exact PO match, no discrepancies.",
-        "flag_for_review": "Minor issues detected requiring human verification before approval.",
-        "escalate_to_human": "Significant issues detected. Immediate human attention required before processing."
-    }
-    reasoning_parts.append(
-        f"RECOMMENDATION: {recommended_action.upper()}. {action_explanations[recommended_action]}"
-    )
+    action_explanation = ACTION_EXPLANATIONS[recommended_action]
+    write(f"RECOMMENDATION: {recommended_action.upper()}. {action_explanation}")
     
-    final_reasoning = " ".join(reasoning_parts)
+    final_reasoning = reasoning_buf.getvalue()
     
     # Update state
     duration_ms = int((time.time() - start_time) * 1000)
@@ -143,13 +155,14 @@ def resolution_agent(state: AgentState) -> AgentState:
     state["recommended_action"] = recommended_action
     state["resolution_reasoning"] = final_reasoning
     state["risk_level"] = risk_level
-    state["agent_traces"] = state.get("agent_traces", {})
-    state["agent_traces"]["resolution_recommendation_agent"] = {
-        "duration_ms": duration_ms,
-        "confidence": 0.95,
-        "status": "success",
-        "reasoning": f"Recommended {recommended_action} based on {len(decision_factors)} factors"
-    }
+    record_trace(
+        state,
+        "resolution_recommendation_agent",
+        duration_ms=duration_ms,
+        confidence=0.95,
+        status="success",
+        reasoning=f"Recommended {recommended_action} based on {len(decision_factors)} factors"
+    )
     state["current_agent"] = "complete"
     
     return state
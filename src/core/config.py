@@ -1,6 +1,7 @@
 """Configuration for the multi-agent invoice reconciliation system."""
 
 import os
+from dataclasses import dataclass
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -10,6 +11,7 @@ load_dotenv()
 # API Configuration
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 GEMINI_MODEL = "gemini-1.5-flash"
+INVOICE_CONCURRENCY = 4  # Max invoices processed at once by --process-all
 
 # Paths
 PROJECT_ROOT = Path(__file__).parent.parent.parent
@@ -20,31 +22,39 @@ OUTPUT_DIR.mkdir(exist_ok=True)
 # PO Database
 PO_DATABASE_PATH = PROVIDEDFILES_DIR / "purchase_orders.json"
 
+# Extraction cache (Gemini results keyed by model, prompt version and file hash)
+EXTRACTION_CACHE_DIR = PROJECT_ROOT / ".cache" / "extractions"
+EXTRACTION_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # 7 days
+
 # Reconciliation Rules (from Reconciliation_Rules.md)
+@dataclass(frozen=True)
 class ReconciliationRules:
     """Thresholds and rules for invoice reconciliation."""
     
     # Price variance thresholds
-    PRICE_VARIANCE_AUTO_APPROVE = 0.02  # ±2%
-    PRICE_VARIANCE_FLAG_REVIEW = 0.15   # ≤15%
-    PRICE_VARIANCE_ESCALATE = 0.15      # >15%
+    PRICE_VARIANCE_AUTO_APPROVE: float = 0.02    # ±2%
+    PRICE_VARIANCE_FLAG_REVIEW: float = 0.15     # ≤15%
+    PRICE_VARIANCE_ESCALATE: float = 0.15        # >15%
     
     # Total variance thresholds
-    TOTAL_VARIANCE_AMOUNT = 5.0         # £5
-    TOTAL_VARIANCE_PERCENT = 0.01       # 1%
+    TOTAL_VARIANCE_AMOUNT: float = 5.0           # £5
+    TOTAL_VARIANCE_PERCENT: float = 0.01         # 1%
     
     # Confidence thresholds
-    CONFIDENCE_AUTO_APPROVE = 0.90      # ≥90%
-    CONFIDENCE_FLAG_REVIEW_MIN = 0.70   # 70-89%
-    CONFIDENCE_ESCALATE = 0.70          # <70%
+    CONFIDENCE_AUTO_APPROVE: float = 0.90        # ≥90%
+    CONFIDENCE_FLAG_REVIEW_MIN: float = 0.70     # 70-89%
+    CONFIDENCE_ESCALATE: float = 0.70            # <70%
     
     # Matching thresholds
-    PO_MATCH_EXACT_CONFIDENCE = 0.95
-    FUZZY_MATCH_SUPPLIER_MIN = 0.70
-    FUZZY_MATCH_PRODUCT_MIN = 0.80
+    PO_MATCH_EXACT_CONFIDENCE: float = 0.95
+    FUZZY_MATCH_SUPPLIER_MIN: float = 0.70
+    FUZZY_MATCH_PRODUCT_MIN: float = 0.80
     
     # Date matching
-    DATE_VARIANCE_DAYS = 14
+    DATE_VARIANCE_DAYS: int = 14
+
+
+RULES = ReconciliationRules()  # Shared immutable instance used by the agents
 
 # Agent names for tracing
 AGENT_NAMES = {
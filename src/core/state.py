@@ -42,3 +42,23 @@ class AgentState(TypedDict, total=False):
     errors: List[str]
     current_agent: str
     processing_start_time: float
+
+
+def record_trace(
+    state: AgentState,
+    agent_name: str,
+    duration_ms: int,
+    confidence: float,
+    status: str,
+    reasoning: str
+) -> None:
+    """Record an agent's execution trace on the state, creating the trace dict if missing or None."""
+    traces = state.get("agent_traces")
+    if traces is None:
+        traces = state["agent_traces"] = {}
+    traces[agent_name] = {
+        "duration_ms": duration_ms,
+        "confidence": confidence,
+        "status": status,
+        "reasoning": reasoning
+    }
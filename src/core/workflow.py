@@ -1,15 +1,21 @@
 """LangGraph workflow for invoice reconciliation multi-agent system."""
 
+import asyncio
 import time
+from functools import lru_cache
 from typing import Literal
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 
 from src.core.state import AgentState
-from src.agents.document_intelligence import document_intelligence_agent
+from src.agents.document_intelligence import (
+    document_intelligence_agent,
+    document_intelligence_agent_async
+)
 from src.agents.matching_agent import matching_agent
 from src.agents.discrepancy_detection import discrepancy_detection_agent
 from src.agents.resolution_agent import resolution_agent
-from src.agents.human_reviewer import human_reviewer_agent
+from src.agents.human_reviewer import human_reviewer_agent, human_reviewer_agent_async
 
 
 def should_continue_to_matching(state: AgentState) -> Literal["matching", "error"]:
@@ -53,11 +59,18 @@ def create_workflow() -> StateGraph:
     workflow = StateGraph(AgentState)
     
     # Add nodes for each agent
-    workflow.add_node("document_intelligence", document_intelligence_agent)
+    # Extraction has an async variant so ainvoke can overlap Gemini calls across invoices
+    workflow.add_node(
+        "document_intelligence",
+        RunnableLambda(document_intelligence_agent, afunc=document_intelligence_agent_async)
+    )
     workflow.add_node("matching", matching_agent)
     workflow.add_node("discrepancy_detection", discrepancy_detection_agent)
     workflow.add_node("resolution", resolution_agent)
-    workflow.add_node("human_review", human_reviewer_agent)
+    workflow.add_node(
+        "human_review",
+        RunnableLambda(human_reviewer_agent, afunc=human_reviewer_agent_async)
+    )
     workflow.add_node("error_handler", error_handler)
     
     # Set the entry point
@@ -110,6 +123,33 @@ def compile_workflow():
     return workflow.compile()
 
 
+@lru_cache(maxsize=1)
+def get_app():
+    """Return the compiled workflow, compiling it on first use and reusing it afterwards."""
+    return compile_workflow()
+
+
+@lru_cache(maxsize=1)
+def _load_po_list() -> list:
+    """Load the PO database as dicts once per process for the initial state."""
+    from src.utils.po_database import get_po_database
+    
+    return get_po_database().to_dict_list()
+
+
+def _build_initial_state(invoice_path: str, po_database: list = None) -> AgentState:
+    """Build the initial workflow state for one invoice."""
+    return {
+        "invoice_path": invoice_path,
+        "po_database": po_database or _load_po_list(),
+        "errors": [],
+        "agent_traces": {},
+        "processing_start_time": time.time(),
+        "discrepancies": [],
+        "needs_reprocessing": False
+    }
+
+
 def run_invoice_processing(invoice_path: str, po_database: list = None) -> dict:
     """
     Run the complete invoice processing workflow.
@@ -121,23 +161,27 @@ def run_invoice_processing(invoice_path: str, po_database: list = None) -> dict:
     Returns:
         Final state dict with all processing results
     """
-    from src.utils.po_database import PODatabase
-    
     # Initialize state
-    initial_state: AgentState = {
-        "invoice_path": invoice_path,
-        "po_database": po_database or PODatabase().to_dict_list(),
-        "errors": [],
-        "agent_traces": {},
-        "processing_start_time": time.time(),
-        "discrepancies": [],
-        "needs_reprocessing": False
-    }
-    
-    # Compile and run workflow
-    app = compile_workflow()
+    initial_state = _build_initial_state(invoice_path, po_database)
     
-    # Run the workflow
-    final_state = app.invoke(initial_state)
+    # Run the shared compiled workflow
+    final_state = get_app().invoke(initial_state)
     
     return final_state
+
+
+async def arun_invoice_processing(invoice_path: str, po_database: list = None) -> dict:
+    """
+    Async variant of run_invoice_processing using ainvoke.
+    Gemini calls are awaited, so one event loop can process many invoices at once.
+    
+    Args:
+        invoice_path: Path to the invoice PDF/image
+        po_database: Optional pre-loaded PO database
+        
+    Returns:
+        Final state dict with all processing results
+    """
+    initial_state = await asyncio.to_thread(_build_initial_state, invoice_path, po_database)
+    
+    return await get_app().ainvoke(initial_state)
@@ -1,26 +1,34 @@
 """FastAPI Dashboard for Invoice Reconciliation System."""
 
-import json
+import asyncio
+import os
+import shutil
+import tempfile
 import time
+from collections import Counter
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 from fastapi import FastAPI, HTTPException, File, UploadFile, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+import orjson
 import uvicorn
 
 from src.core.config import PROVIDEDFILES_DIR, OUTPUT_DIR
-from src.core.workflow import run_invoice_processing
+from src.core.workflow import arun_invoice_processing
+from src.models.schemas import DiscrepancyListAdapter
+from src.utils.output import write_result_file_async
 
 
 # Create FastAPI app
 app = FastAPI(
     title="Invoice Reconciliation Dashboard",
     description="Multi-Agent AI System for Invoice Processing",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Setup templates and static files
@@ -29,20 +37,142 @@ templates = Jinja2Templates(directory=str(DASHBOARD_DIR / "templates"))
 app.mount("/static", StaticFiles(directory=str(DASHBOARD_DIR / "static")), name="static")
 
 
+class ResultsIndex:
+    """
+    In-memory view of the result JSON files in an output directory.
+    Each refresh stats the directory and only re-parses files whose mtime or size changed,
+    so results written by the CLI while the dashboard runs are still picked up.
+    Scans are throttled to one per refresh_interval seconds, since the page and its
+    polling endpoints tend to hit the index together.
+    """
+    
+    def __init__(self, output_dir: Path, refresh_interval: float = 1.0):
+        self.output_dir = output_dir
+        self.refresh_interval = refresh_interval
+        self._last_scan = float("-inf")
+        self._files: Dict[str, Tuple[int, int, Optional[dict]]] = {}  # name -> (mtime_ns, size, data)
+        self._results: List[dict] = []
+        self._by_id: Dict[str, dict] = {}
+        self._stats: dict = self._compute_stats()
+    
+    def refresh(self, force: bool = False) -> None:
+        """Sync the index with the files currently on disk, unless it was synced very recently."""
+        now = time.monotonic()
+        if not force and now - self._last_scan < self.refresh_interval:
+            return
+        self._last_scan = now
+        
+        try:
+            # DirEntry caches the stat from the directory scan; close the handle promptly
+            with os.scandir(self.output_dir) as it:
+                entries = [e for e in it if e.name.endswith(".json") and e.is_file()]
+        except FileNotFoundError:
+            entries = []
+        
+        changed = False
+        files = {}
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                cached = self._files.get(entry.name)
+                if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                    files[entry.name] = cached
+                    continue
+                with open(entry.path, "rb") as file:
+                    data = orjson.loads(file.read())
+            except OSError:
+                # Removed or replaced since the directory scan; the next refresh sees its current state
+                continue
+            except orjson.JSONDecodeError:
+                data = None
+            # Valid JSON that is not a result object (e.g. a list) is skipped like unreadable files
+            if not isinstance(data, dict):
+                data = None
+            files[entry.name] = (stat.st_mtime_ns, stat.st_size, data)
+            changed = True
+        
+        if changed or files.keys() != self._files.keys():
+            self._files = files
+            self._rebuild()
+    
+    def _rebuild(self) -> None:
+        """Rebuild the filename-ordered result list and the invoice id lookup."""
+        self._results = [self._files[name][2] for name in sorted(self._files) if self._files[name][2] is not None]
+        self._by_id = {}
+        for data in self._results:
+            self._by_id.setdefault(data.get("invoice_id"), data)
+        self._stats = self._compute_stats()
+    
+    def _compute_stats(self) -> dict:
+        """Aggregate dashboard statistics over the indexed results."""
+        results = self._results
+        if not results:
+            return {
+                "total_invoices": 0,
+                "auto_approved": 0,
+                "flagged_for_review": 0,
+                "escalated": 0,
+                "avg_processing_time": 0,
+                "avg_confidence": 0
+            }
+        
+        # One pass over the results for every counter and sum
+        action_counts = Counter()
+        time_sum = 0
+        confidence_sum = 0
+        for r in results:
+            processing_results = r.get("processing_results", {})
+            action_counts[processing_results.get("recommended_action", "")] += 1
+            time_sum += r.get("processing_duration_seconds", 0)
+            confidence_sum += processing_results.get("extraction_confidence", 0)
+        
+        count = len(results)
+        return {
+            "total_invoices": count,
+            "auto_approved": action_counts["auto_approve"],
+            "flagged_for_review": action_counts["flag_for_review"],
+            "escalated": action_counts["escalate_to_human"],
+            "avg_processing_time": round(time_sum / count, 2),
+            "avg_confidence": round(confidence_sum / count * 100, 1)
+        }
+    
+    def record(self, path: Path, data: dict) -> None:
+        """Index a result file that was just written, without re-reading it."""
+        stat = path.stat()
+        self._files[path.name] = (stat.st_mtime_ns, stat.st_size, data)
+        self._rebuild()
+    
+    def results(self) -> List[dict]:
+        """All indexed results, ordered by filename."""
+        self.refresh()
+        return self._results
+    
+    def stats(self) -> dict:
+        """Statistics over all results; recomputed only when the set of results changes."""
+        self.refresh()
+        return dict(self._stats)
+    
+    def get(self, invoice_id: str) -> Optional[dict]:
+        """Look up a result by invoice id."""
+        self.refresh()
+        return self._by_id.get(invoice_id)
+
+
+# Handlers run on one event loop and the index has no awaits, so no lock is needed
+results_index = ResultsIndex(OUTPUT_DIR)
+
+
+@app.on_event("startup")
+async def load_results_index():
+    """Parse existing result files once at startup."""
+    results_index.refresh(force=True)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Render the main dashboard."""
     # Load existing results
-    results = []
-    output_files = list(OUTPUT_DIR.glob("*.json")) if OUTPUT_DIR.exists() else []
-    
-    for f in sorted(output_files):
-        try:
-            with open(f) as file:
-                data = json.load(file)
-                results.append(data)
-        except:
-            pass
+    results = results_index.results()
     
     return templates.TemplateResponse("index.html", {
         "request": request,
@@ -54,16 +184,7 @@ async def home(request: Request):
 @app.get("/api/results")
 async def get_results():
     """Get all processing results as JSON."""
-    results = []
-    output_files = list(OUTPUT_DIR.glob("*.json")) if OUTPUT_DIR.exists() else []
-    
-    for f in sorted(output_files):
-        try:
-            with open(f) as file:
-                data = json.load(file)
-                results.append(data)
-        except:
-            pass
+    results = results_index.results()
     
     return {"results": results, "count": len(results)}
 
@@ -71,34 +192,41 @@ async def get_results():
 @app.get("/api/result/{invoice_id}")
 async def get_result(invoice_id: str):
     """Get a specific processing result."""
-    output_files = list(OUTPUT_DIR.glob("*.json")) if OUTPUT_DIR.exists() else []
-    
-    for f in output_files:
-        try:
-            with open(f) as file:
-                data = json.load(file)
-                if data.get("invoice_id") == invoice_id:
-                    return data
-        except:
-            pass
+    data = results_index.get(invoice_id)
+    if data is not None:
+        return data
     
     raise HTTPException(status_code=404, detail="Invoice not found")
 
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MB
+
+
+def save_upload(file: UploadFile, dest_dir: Path) -> Path:
+    """
+    Copy an upload to a uniquely named temp file in chunks, never holding the whole body in memory.
+    The original suffix is kept because extraction picks the MIME type from it.
+    """
+    with tempfile.NamedTemporaryFile(
+        dir=dest_dir,
+        prefix="temp_",
+        suffix=Path(file.filename).suffix,
+        delete=False
+    ) as out:
+        shutil.copyfileobj(file.file, out, UPLOAD_CHUNK_SIZE)
+    return Path(out.name)
+
+
 @app.post("/api/process")
 async def process_invoice(file: UploadFile = File(...)):
     """Process an uploaded invoice."""
     # Save uploaded file temporarily
-    temp_path = PROVIDEDFILES_DIR / f"temp_{file.filename}"
+    temp_path = await asyncio.to_thread(save_upload, file, PROVIDEDFILES_DIR)
     
     try:
-        contents = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(contents)
-        
         # Process the invoice
         start_time = time.time()
-        final_state = run_invoice_processing(str(temp_path))
+        final_state = await arun_invoice_processing(str(temp_path))
         processing_time = time.time() - start_time
         
         # Build result
@@ -116,8 +244,8 @@ async def process_invoice(file: UploadFile = File(...)):
             },
             "processing_results": {
                 "extraction_confidence": final_state.get("extraction_confidence", 0.0),
-                "matching_results": matching_results.model_dump() if matching_results else None,
-                "discrepancies": [d.model_dump() for d in discrepancies] if discrepancies else [],
+                "matching_results": matching_results.model_dump(mode="json") if matching_results else None,
+                "discrepancies": DiscrepancyListAdapter.dump_python(discrepancies, mode="json"),
                 "recommended_action": final_state.get("recommended_action", "escalate_to_human"),
                 "risk_level": final_state.get("risk_level", "high")
             },
@@ -126,8 +254,8 @@ async def process_invoice(file: UploadFile = File(...)):
         
         # Save result
         output_file = OUTPUT_DIR / f"{Path(file.filename).stem}.json"
-        with open(output_file, 'w') as f:
-            json.dump(result, f, indent=2, default=str)
+        await write_result_file_async(output_file, result)
+        results_index.record(output_file, result)
         
         return result
         
@@ -140,44 +268,13 @@ async def process_invoice(file: UploadFile = File(...)):
 @app.get("/api/stats")
 async def get_stats():
     """Get processing statistics."""
-    results = []
-    output_files = list(OUTPUT_DIR.glob("*.json")) if OUTPUT_DIR.exists() else []
-    
-    for f in output_files:
-        try:
-            with open(f) as file:
-                data = json.load(file)
-                results.append(data)
-        except:
-            pass
-    
-    if not results:
-        return {
-            "total_invoices": 0,
-            "auto_approved": 0,
-            "flagged_for_review": 0,
-            "escalated": 0,
-            "avg_processing_time": 0,
-            "avg_confidence": 0
-        }
-    
-    actions = [r.get("processing_results", {}).get("recommended_action", "") for r in results]
-    times = [r.get("processing_duration_seconds", 0) for r in results]
-    confidences = [r.get("processing_results", {}).get("extraction_confidence", 0) for r in results]
-    
-    return {
-        "total_invoices": len(results),
-        "auto_approved": actions.count("auto_approve"),
-        "flagged_for_review": actions.count("flag_for_review"),
-        "escalated": actions.count("escalate_to_human"),
-        "avg_processing_time": round(sum(times) / len(times), 2) if times else 0,
-        "avg_confidence": round(sum(confidences) / len(confidences) * 100, 1) if confidences else 0
-    }
+    return results_index.stats()
 
 
 def run_dashboard(host: str = "127.0.0.1", port: int = 8000):
     """Run the dashboard server."""
-    uvicorn.run(app, host=host, port=port)
+    # "auto" selects uvloop when it is installed and falls back to asyncio otherwise
+    uvicorn.run(app, host=host, port=port, loop="auto")
 
 
 if __name__ == "__main__":
@@ -10,7 +10,7 @@ Usage:
 """
 
 import argparse
-import json
+import asyncio
 import time
 import sys
 from pathlib import Path
@@ -25,9 +25,15 @@ from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn
 from rich import print as rprint
 
-from src.core.config import PROVIDEDFILES_DIR, OUTPUT_DIR, GOOGLE_API_KEY
-from src.core.workflow import run_invoice_processing
-from src.models.schemas import ReconciliationResult
+try:
+    import uvloop
+except ImportError:  # Optional: not available on Windows
+    uvloop = None
+
+from src.core.config import PROVIDEDFILES_DIR, OUTPUT_DIR, GOOGLE_API_KEY, INVOICE_CONCURRENCY
+from src.core.workflow import run_invoice_processing, arun_invoice_processing
+from src.models.schemas import ReconciliationResult, DiscrepancyListAdapter
+from src.utils.output import write_result_file, write_result_file_async
 
 
 console = Console()
@@ -52,9 +58,9 @@ def format_result_to_json(state: dict, invoice_path: Path, processing_time: floa
         "processing_results": {
             "extraction_confidence": state.get("extraction_confidence", 0.0),
             "document_quality": state.get("document_quality", "unknown"),
-            "extracted_data": extracted_data.model_dump() if extracted_data else None,
-            "matching_results": matching_results.model_dump() if matching_results else None,
-            "discrepancies": [d.model_dump() for d in discrepancies] if discrepancies else [],
+            "extracted_data": extracted_data.model_dump(mode="json") if extracted_data else None,
+            "matching_results": matching_results.model_dump(mode="json") if matching_results else None,
+            "discrepancies": DiscrepancyListAdapter.dump_python(discrepancies, mode="json"),
             "total_variance": calculate_total_variance(state),
             "recommended_action": state.get("recommended_action", "escalate_to_human"),
             "risk_level": state.get("risk_level", "high"),
@@ -158,6 +164,24 @@ def process_invoice(invoice_path: Path, show_progress: bool = True) -> dict:
     return result
 
 
+async def process_invoice_async(invoice_path: Path, semaphore: asyncio.Semaphore) -> dict:
+    """
+    Process a single invoice on the event loop, limited by the shared semaphore.
+    The result file is written as soon as the invoice finishes, while others are still running.
+    """
+    async with semaphore:
+        start_time = time.time()
+        final_state = await arun_invoice_processing(str(invoice_path))
+        processing_time = time.time() - start_time
+    
+    result = format_result_to_json(final_state, invoice_path, processing_time)
+    
+    # Save individual result
+    await write_result_file_async(OUTPUT_DIR / f"{invoice_path.stem}.json", result)
+    
+    return result
+
+
 def display_result_summary(result: dict):
     """Display a nice summary of the processing result."""
     proc_results = result.get("processing_results", {})
@@ -203,8 +227,8 @@ def display_result_summary(result: dict):
             console.print(f"  • [{d.get('severity', 'medium')}] {d.get('details', 'No details')}")
 
 
-def process_all_invoices():
-    """Process all 5 test invoices."""
+async def process_all_invoices():
+    """Process all 5 test invoices concurrently."""
     invoice_files = [
         PROVIDEDFILES_DIR / "Invoice_1_Baseline.pdf",
         PROVIDEDFILES_DIR / "Invoice_2_Scanned.pdf",
@@ -222,22 +246,31 @@ def process_all_invoices():
     total_start = time.time()
     results = []
     
+    existing_files = []
     for invoice_path in invoice_files:
         if not invoice_path.exists():
             console.print(f"[red]ERROR: {invoice_path.name} not found![/red]")
             continue
+        existing_files.append(invoice_path)
+    
+    # Invoices are independent and dominated by Gemini latency, so run them together
+    semaphore = asyncio.Semaphore(INVOICE_CONCURRENCY)
+    with console.status(f"Processing {len(existing_files)} invoices..."):
+        outcomes = await asyncio.gather(
+            *(process_invoice_async(invoice_path, semaphore) for invoice_path in existing_files),
+            return_exceptions=True
+        )
+    
+    for invoice_path, result in zip(existing_files, outcomes):
+        console.print(f"\n[cyan]━━━ Processed: {invoice_path.name} ━━━[/cyan]")
         
-        console.print(f"\n[cyan]━━━ Processing: {invoice_path.name} ━━━[/cyan]")
-        
-        result = process_invoice(invoice_path)
+        if isinstance(result, Exception):
+            console.print(f"[red]ERROR: {invoice_path.name} failed: {result}[/red]")
+            continue
         results.append(result)
         
-        # Save individual result
-        output_file = OUTPUT_DIR / f"{invoice_path.stem}.json"
-        with open(output_file, 'w') as f:
-            json.dump(result, f, indent=2, default=str)
-        
         display_result_summary(result)
+        output_file = OUTPUT_DIR / f"{invoice_path.stem}.json"
         console.print(f"[green]✓ Saved to: {output_file}[/green]")
     
     total_time = time.time() - total_start
@@ -307,7 +340,11 @@ def main():
         sys.exit(1)
     
     if args.process_all or args.demo:
-        process_all_invoices()
+        # Prefer the libuv event loop for the concurrent batch run when installed
+        if uvloop is not None:
+            uvloop.run(process_all_invoices())
+        else:
+            asyncio.run(process_all_invoices())
     elif args.invoice:
         invoice_path = Path(args.invoice)
         if not invoice_path.exists():
@@ -320,8 +357,7 @@ def main():
         # Save result
         output_file = Path(args.output) / f"{invoice_path.stem}.json"
         output_file.parent.mkdir(exist_ok=True)
-        with open(output_file, 'w') as f:
-            json.dump(result, f, indent=2, default=str)
+        write_result_file(output_file, result)
         console.print(f"[green]✓ Saved to: {output_file}[/green]")
     else:
         parser.print_help()
@@ -1,7 +1,7 @@
 """Pydantic models for invoice reconciliation system."""
 
 from typing import Optional, List, Literal
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
 
 
@@ -59,6 +59,10 @@ class Discrepancy(BaseModel):
     confidence: float = Field(default=0.95, ge=0.0, le=1.0)
 
 
+# Dumps a whole discrepancy list in one call instead of a model_dump per item
+DiscrepancyListAdapter = TypeAdapter(List[Discrepancy])
+
+
 class MatchingResult(BaseModel):
     """Results from PO matching."""
     po_match_confidence: float = Field(ge=0.0, le=1.0)
@@ -111,7 +115,7 @@ class ReconciliationResult(BaseModel):
                 "document_quality": document_quality,
                 "extracted_data": extracted_data.model_dump(),
                 "matching_results": matching_results.model_dump(),
-                "discrepancies": [d.model_dump() for d in discrepancies],
+                "discrepancies": DiscrepancyListAdapter.dump_python(discrepancies),
                 "recommended_action": recommended_action,
                 "agent_reasoning": agent_reasoning
             },
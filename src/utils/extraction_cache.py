@@ -0,0 +1,59 @@
+"""On-disk cache for Gemini extraction results."""
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import orjson
+
+from src.core.config import EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_TTL_SECONDS
+
+
+class ExtractionCache:
+    """Content-addressable store of (extracted_data, confidence, reasoning) with a TTL."""
+    
+    def __init__(self, cache_dir: Path = EXTRACTION_CACHE_DIR, ttl_seconds: int = EXTRACTION_CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+    
+    def _entry_path(self, key: str) -> Path:
+        """Map a cache key to its JSON file (keys may contain characters unsafe for filenames)."""
+        return self.cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+    
+    def get(self, key: str) -> Optional[Tuple[dict, float, str]]:
+        """Return a cached extraction, or None if missing, unreadable or expired."""
+        try:
+            entry = orjson.loads(self._entry_path(key).read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        
+        if entry.get("key") != key or entry.get("expires_at", 0) < time.time():
+            return None
+        
+        return entry["extracted_data"], entry["confidence"], entry["reasoning"]
+    
+    def set(self, key: str, value: Tuple[dict, float, str]) -> None:
+        """Store an extraction result; cache write failures are not fatal."""
+        extracted_data, confidence, reasoning = value
+        now = int(time.time())
+        entry = {
+            "key": key,
+            "created_at": now,
+            "expires_at": now + self.ttl_seconds,
+            "extracted_data": extracted_data,
+            "confidence": confidence,
+            "reasoning": reasoning
+        }
+        
+        path = self._entry_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(orjson.dumps(entry))
+            # Atomic rename so concurrent readers never see a partial entry
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
@@ -0,0 +1,56 @@
+"""Shared Gemini SDK setup for agents."""
+
+import json
+from typing import Any, Dict
+import google.generativeai as genai
+import orjson
+
+from src.core.config import GOOGLE_API_KEY, GEMINI_MODEL
+
+
+# Structured output mode: the model returns bare JSON instead of free-form text
+JSON_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json")
+
+_configured = False
+_models: Dict[str, genai.GenerativeModel] = {}
+
+
+def configure_gemini() -> None:
+    """Configure the Gemini SDK once per process."""
+    global _configured
+    if not _configured:
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _configured = True
+
+
+def get_model(model_name: str = GEMINI_MODEL) -> genai.GenerativeModel:
+    """Return the shared GenerativeModel for a model name, creating it on first use."""
+    model = _models.get(model_name)
+    if model is None:
+        configure_gemini()
+        model = _models[model_name] = genai.GenerativeModel(model_name)
+    return model
+
+
+def strip_code_fences(response_text: str) -> str:
+    """
+    Return the JSON body of a model response, dropping markdown code fences if present.
+    Responses requested with JSON_GENERATION_CONFIG have no fences; this is the fallback.
+    """
+    # Plain string handling stays linear on long whitespace runs, which a fence regex does not
+    body = response_text.strip()
+    body = body.removeprefix("```").removeprefix("json")
+    body = body.removesuffix("```")
+    return body.strip()
+
+
+def parse_json_response(response_text: str) -> Any:
+    """
+    Parse a model's JSON response with orjson.
+    orjson is stricter (e.g. NaN literals), so fall back to the stdlib parser on failure.
+    Raises json.JSONDecodeError if neither can parse it.
+    """
+    try:
+        return orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        return json.loads(response_text)
@@ -0,0 +1,16 @@
+"""Result file serialization shared by the CLI and the dashboard."""
+
+import asyncio
+from pathlib import Path
+
+import orjson
+
+
+def write_result_file(output_file: Path, result: dict) -> None:
+    """Write a processing result as indented JSON; unknown types fall back to str."""
+    output_file.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2, default=str))
+
+
+async def write_result_file_async(output_file: Path, result: dict) -> None:
+    """Write a processing result from a worker thread so encoding and disk I/O stay off the event loop."""
+    await asyncio.to_thread(write_result_file, output_file, result)
@@ -1,13 +1,22 @@
 """Purchase Order database utilities."""
 
-import json
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
+import numpy as np
+import orjson
 from rapidfuzz import fuzz, process
 from src.core.config import PO_DATABASE_PATH
 from src.models.schemas import PurchaseOrder, LineItem
 
 
+# Supplier similarity is the best of these scorers
+SUPPLIER_SCORERS = (fuzz.ratio, fuzz.partial_ratio, fuzz.token_sort_ratio)
+
+# Distinct find_best_match inputs remembered per database
+MATCH_CACHE_SIZE = 1024
+
+
 class PODatabase:
     """Purchase Order database with fuzzy search capabilities."""
     
@@ -15,11 +24,14 @@ class PODatabase:
         self.db_path = db_path
         self.purchase_orders: List[PurchaseOrder] = []
         self._load_database()
+        self._build_index()
+        # POs are read-only after load, so match results can be memoized for the database's lifetime
+        self._cached_match = lru_cache(maxsize=MATCH_CACHE_SIZE)(self._find_best_match)
     
     def _load_database(self):
         """Load PO database from JSON file."""
-        with open(self.db_path, 'r') as f:
-            data = json.load(f)
+        with open(self.db_path, 'rb') as f:
+            data = orjson.loads(f.read())
         
         for po_data in data.get("purchase_orders", []):
             line_items = [
@@ -44,60 +56,127 @@ class PODatabase:
             )
             self.purchase_orders.append(po)
     
+    def _build_index(self):
+        """Precompute lookup structures so queries do not re-normalize the database."""
+        # Case-insensitive PO number index; the first PO wins on duplicates, as with a linear scan
+        self._po_by_number: Dict[str, PurchaseOrder] = {}
+        for po in self.purchase_orders:
+            self._po_by_number.setdefault(po.po_number.upper(), po)
+        
+        # State snapshot for to_dict_list
+        self._po_dicts = [po.model_dump() for po in self.purchase_orders]
+        
+        # Distinct lowercased supplier names; many POs share a supplier, so each name is
+        # scored once and mapped back to its POs through _supplier_codes
+        supplier_codes: Dict[str, int] = {}
+        self._supplier_codes = np.array(
+            [supplier_codes.setdefault(po.supplier.lower(), len(supplier_codes)) for po in self.purchase_orders],
+            dtype=np.intp
+        )
+        self._unique_suppliers = list(supplier_codes)
+        
+        # Lowercased line-item descriptions, aligned with self.purchase_orders
+        self._descriptions_lower = [
+            [item.description.lower() for item in po.line_items]
+            for po in self.purchase_orders
+        ]
+        
+        # Flattened description corpus for batch scoring; each PO with line items owns the
+        # contiguous column range starting at its offset
+        self._all_descriptions_lower = [desc for descs in self._descriptions_lower for desc in descs]
+        self._pos_with_items = np.array([i for i, descs in enumerate(self._descriptions_lower) if descs], dtype=np.intp)
+        self._description_offsets = np.cumsum(
+            [0] + [len(self._descriptions_lower[i]) for i in self._pos_with_items[:-1]],
+            dtype=np.intp
+        )
+    
     def get_by_po_number(self, po_number: str) -> Optional[PurchaseOrder]:
         """Get PO by exact PO number match."""
-        for po in self.purchase_orders:
-            if po.po_number.upper() == po_number.upper():
-                return po
-        return None
+        return self._po_by_number.get(po_number.upper())
     
     def fuzzy_match_supplier(self, supplier_name: str, threshold: float = 70) -> List[Tuple[PurchaseOrder, float]]:
         """Find POs by fuzzy supplier name matching."""
-        results = []
-        for po in self.purchase_orders:
-            # Try multiple fuzzy matching strategies
-            ratio = fuzz.ratio(supplier_name.lower(), po.supplier.lower())
-            partial_ratio = fuzz.partial_ratio(supplier_name.lower(), po.supplier.lower())
-            token_sort = fuzz.token_sort_ratio(supplier_name.lower(), po.supplier.lower())
-            
-            # Use best score
-            score = max(ratio, partial_ratio, token_sort)
-            
-            if score >= threshold:
-                results.append((po, score / 100.0))
+        query = [supplier_name.lower()]
+        
+        # Try multiple fuzzy matching strategies, each scored against all POs in one call,
+        # and use the best score per PO. With score_cutoff rapidfuzz abandons pairs that cannot
+        # reach the threshold (e.g. very different lengths) and reports them as 0.
+        unique_scores = np.maximum.reduce([
+            process.cdist(query, self._unique_suppliers, scorer=scorer, dtype=np.float64, score_cutoff=threshold)[0]
+            for scorer in SUPPLIER_SCORERS
+        ])
+        scores = unique_scores[self._supplier_codes]
         
-        # Sort by score descending
-        return sorted(results, key=lambda x: x[1], reverse=True)
+        # Sort by score descending; the stable sort keeps database order for ties
+        matched = np.flatnonzero(scores >= threshold)
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        
+        return [
+            (self.purchase_orders[i], score / 100.0)
+            for i, score in zip(matched.tolist(), scores[matched].tolist())
+        ]
+    
+    def _product_best_scores(self, product_descriptions: List[str], score_cutoff: float = 0) -> np.ndarray:
+        """
+        Score invoice descriptions against every PO line item in one batch.
+        Scores below score_cutoff are reported as 0, letting rapidfuzz skip hopeless pairs early.
+        Returns: (POs x descriptions) array of the best token_sort_ratio per PO and description;
+        rows of POs without line items are -1 so they never reach a threshold.
+        """
+        descriptions_lower = [desc.lower() for desc in product_descriptions]
+        best_scores = np.full((len(self.purchase_orders), len(descriptions_lower)), -1.0)
+        
+        if descriptions_lower and self._all_descriptions_lower:
+            matrix = process.cdist(
+                descriptions_lower,
+                self._all_descriptions_lower,
+                scorer=fuzz.token_sort_ratio,
+                dtype=np.float64,
+                score_cutoff=score_cutoff
+            )
+            # Best score within each PO's column range
+            best_scores[self._pos_with_items] = np.maximum.reduceat(matrix, self._description_offsets, axis=1).T
+        
+        return best_scores
+    
+    def _rank_product_matches(
+        self,
+        best_scores: np.ndarray,
+        description_count: int,
+        threshold: float
+    ) -> List[Tuple[PurchaseOrder, float, int]]:
+        """Rank POs from precomputed product scores, counting only scores at or above threshold."""
+        mask = best_scores >= threshold
+        matched_counts = mask.sum(axis=1)
+        
+        # Add matched scores column by column so each PO's sum accumulates in description order
+        score_sums = np.zeros(len(best_scores))
+        for column in np.where(mask, best_scores, 0.0).T:
+            score_sums += column
+        
+        candidates = np.flatnonzero(matched_counts)
+        matched_counts = matched_counts[candidates]
+        avg_scores = score_sums[candidates] / description_count
+        match_rates = matched_counts / description_count
+        # Combined score: weighted average of match rate and similarity
+        combined_scores = match_rates * 0.6 + (avg_scores / 100) * 0.4
+        
+        # Most matched descriptions first, then combined score; lexsort is stable, so ties keep database order
+        order = np.lexsort((-combined_scores, -matched_counts))
+        
+        return [
+            (self.purchase_orders[i], combined_score, matched_count)
+            for i, combined_score, matched_count in zip(
+                candidates[order].tolist(),
+                combined_scores[order].tolist(),
+                matched_counts[order].tolist()
+            )
+        ]
     
     def fuzzy_match_products(self, product_descriptions: List[str], threshold: float = 70) -> List[Tuple[PurchaseOrder, float, int]]:
         """Find POs by fuzzy product description matching."""
-        results = []
-        
-        for po in self.purchase_orders:
-            po_descriptions = [item.description.lower() for item in po.line_items]
-            matched_count = 0
-            total_score = 0
-            
-            for desc in product_descriptions:
-                desc_lower = desc.lower()
-                best_match = process.extractOne(
-                    desc_lower, 
-                    po_descriptions,
-                    scorer=fuzz.token_sort_ratio
-                )
-                
-                if best_match and best_match[1] >= threshold:
-                    matched_count += 1
-                    total_score += best_match[1]
-            
-            if matched_count > 0:
-                avg_score = total_score / len(product_descriptions)
-                match_rate = matched_count / len(product_descriptions)
-                # Combined score: weighted average of match rate and similarity
-                combined_score = (match_rate * 0.6 + (avg_score / 100) * 0.4)
-                results.append((po, combined_score, matched_count))
-        
-        return sorted(results, key=lambda x: (x[2], x[1]), reverse=True)
+        best_scores = self._product_best_scores(product_descriptions, score_cutoff=threshold)
+        return self._rank_product_matches(best_scores, len(product_descriptions), threshold)
     
     def find_best_match(
         self, 
@@ -108,34 +187,104 @@ class PODatabase:
     ) -> Tuple[Optional[PurchaseOrder], str, float]:
         """
         Find best matching PO using 3-tier strategy.
+        Results are memoized, so repeated lookups for the same invoice skip all tiers.
         Returns: (matched_po, match_method, confidence)
         """
+        matched_po, match_method, confidence, _ = self._cached_match(
+            po_reference,
+            supplier_name,
+            tuple(product_descriptions),
+            invoice_total,
+            0,
+            0
+        )
+        return matched_po, match_method, confidence
+    
+    def find_best_match_with_candidates(
+        self,
+        po_reference: Optional[str],
+        supplier_name: str,
+        product_descriptions: List[str],
+        invoice_total: float,
+        top_k: int = 3,
+        top_k_threshold: float = 60
+    ) -> Tuple[Optional[PurchaseOrder], str, float, List[Tuple[PurchaseOrder, float, int]]]:
+        """
+        find_best_match plus the top-k product candidates at top_k_threshold,
+        taken from the same product scoring pass (empty when Tier 1 matched).
+        Returns: (matched_po, match_method, confidence, candidates)
+        """
+        matched_po, match_method, confidence, candidates = self._cached_match(
+            po_reference,
+            supplier_name,
+            tuple(product_descriptions),
+            invoice_total,
+            top_k,
+            top_k_threshold
+        )
+        # Callers get their own candidate list, not the cached tuple
+        return matched_po, match_method, confidence, list(candidates)
+    
+    def _find_best_match(
+        self,
+        po_reference: Optional[str],
+        supplier_name: str,
+        product_descriptions: Tuple[str, ...],
+        invoice_total: float,
+        top_k: int,
+        top_k_threshold: float
+    ) -> Tuple[Optional[PurchaseOrder], str, float, Tuple[Tuple[PurchaseOrder, float, int], ...]]:
+        """
+        Uncached match shared by find_best_match and find_best_match_with_candidates;
+        arguments must be hashable. Product descriptions are scored once and reused by every tier.
+        Returns: (matched_po, match_method, confidence, top_k_candidates)
+        """
         # Tier 1: Exact PO reference match
         if po_reference:
             po = self.get_by_po_number(po_reference)
             if po:
-                return (po, "exact_po_reference", 0.98)
+                return (po, "exact_po_reference", 0.98, ())
+        
+        # Tiers 2 and 3 only count product scores of 65 and up; lower ones matter only for top-k
+        score_cutoff = min(65, top_k_threshold) if top_k else 65
+        best_scores = self._product_best_scores(product_descriptions, score_cutoff=score_cutoff)
+        description_count = len(product_descriptions)
+        result = self._match_fuzzy_tiers(best_scores, description_count, supplier_name, invoice_total)
         
+        candidates = ()
+        if top_k:
+            candidates = tuple(self._rank_product_matches(best_scores, description_count, top_k_threshold)[:top_k])
+        return (*result, candidates)
+    
+    def _match_fuzzy_tiers(
+        self,
+        best_scores: np.ndarray,
+        description_count: int,
+        supplier_name: str,
+        invoice_total: float
+    ) -> Tuple[Optional[PurchaseOrder], str, float]:
+        """Tiers 2 and 3 of find_best_match, on precomputed product scores."""
         # Tier 2: Supplier + Products match
         supplier_matches = self.fuzzy_match_supplier(supplier_name, threshold=60)
         if supplier_matches:
+            # Rank products once and group them by PO number, keeping rank order
+            products_by_po: Dict[str, List[Tuple[PurchaseOrder, float]]] = {}
+            for matched_po, prod_score, matched_count in self._rank_product_matches(best_scores, description_count, threshold=65):
+                products_by_po.setdefault(matched_po.po_number, []).append((matched_po, prod_score))
+            
             for po, supplier_score in supplier_matches:
-                po_descriptions = [item.description for item in po.line_items]
-                product_matches = self.fuzzy_match_products(product_descriptions, threshold=65)
-                
-                for matched_po, prod_score, matched_count in product_matches:
-                    if matched_po.po_number == po.po_number:
-                        # Check total similarity
-                        total_diff = abs(matched_po.total - invoice_total) / matched_po.total
-                        if total_diff < 0.15:  # Within 15% total variance
-                            combined = (supplier_score * 0.4 + prod_score * 0.4 + (1 - total_diff) * 0.2)
-                            return (matched_po, "fuzzy_supplier_product_match", min(combined, 0.90))
+                for matched_po, prod_score in products_by_po.get(po.po_number, ()):
+                    # Check total similarity
+                    total_diff = abs(matched_po.total - invoice_total) / matched_po.total
+                    if total_diff < 0.15:  # Within 15% total variance
+                        combined = (supplier_score * 0.4 + prod_score * 0.4 + (1 - total_diff) * 0.2)
+                        return (matched_po, "fuzzy_supplier_product_match", min(combined, 0.90))
         
         # Tier 3: Product-only match
-        product_matches = self.fuzzy_match_products(product_descriptions, threshold=70)
+        product_matches = self._rank_product_matches(best_scores, description_count, threshold=70)
         if product_matches:
             best_po, score, matched_count = product_matches[0]
-            match_rate = matched_count / len(product_descriptions)
+            match_rate = matched_count / description_count
             if match_rate >= 0.7:
                 confidence = score * 0.7  # Lower confidence for product-only match
                 return (best_po, "product_only_match", min(confidence, 0.70))
@@ -147,5 +296,17 @@ class PODatabase:
         return self.purchase_orders
     
     def to_dict_list(self) -> List[dict]:
-        """Convert all POs to list of dicts for state."""
-        return [po.model_dump() for po in self.purchase_orders]
+        """
+        Convert all POs to list of dicts for state.
+        The dicts are dumped once at load and shared between calls, so treat them as read-only.
+        """
+        return list(self._po_dicts)
+
+
+@lru_cache(maxsize=1)
+def get_po_database() -> PODatabase:
+    """
+    Return the process-wide PODatabase, loading and indexing it on first use.
+    Callers must treat it as read-only since it is shared across invoices.
+    """
+    return PODatabase()